@@ -1,18 +1,33 @@
+import math
 from os import getenv
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, abort, stream_with_context
 from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
-
-from models import db, setup_db, Actor, Movie, Role
-from auth.auth import AuthError, requires_auth
-
-
-def create_app(test_db=None):
+from functools import wraps
+from itertools import islice
+from psycopg2 import errorcodes
+from sqlalchemy import Integer, cast, collate, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from werkzeug.exceptions import HTTPException
+
+import config
+from cache import ResponseCache
+from importer import setup_importer
+from models import db, setup_db, Actor, Movie, Role, TableVersion
+from serializer import setup_serializer, jsonify, dumps
+from auth.auth import AuthError, requires_auth, auth_ready, auth_metrics, \
+    check_permissions
+
+
+def create_app(test_db=None, json_encoder=None):
     app = Flask(__name__)
     setup_db(app, test_db)
+    setup_serializer(app, json_encoder or config.JSON_ENCODER)
     migrate = Migrate(app, db)
     CORS(app)
+    setup_importer(app)
     return app
 
 
@@ -29,23 +44,726 @@ def index():
     return "This is the Casting Agency API"
 
 
+'''
+GET /ready
+    It is a public endpoint.
+    It returns 200 once the keys used to verify tokens are loaded,
+    and 503 until then, so it can be used as a readiness check.
+'''
+@APP.route('/ready')
+def ready():
+    is_ready = auth_ready()
+
+    return jsonify({
+        'success': is_ready,
+        'ready': is_ready
+    }), 200 if is_ready else 503
+
+
+def check_metrics_enabled():
+    '''
+    check_metrics_enabled() method
+        it aborts with 404 unless the METRICS_ENABLED setting is turned
+            on, so the metrics endpoints are not served by default
+    '''
+    if not APP.config.get('METRICS_ENABLED', config.METRICS_ENABLED):
+        abort(404, description='Metrics are not enabled.')
+
+
+'''
+GET /metrics/auth
+    It is a public endpoint, only served if METRICS_ENABLED is set.
+    It returns the verified-token cache counters and, if AUTH_TIMING
+    is enabled, histograms (in milliseconds) of the time spent in each
+    phase of the auth checks.
+'''
+@APP.route('/metrics/auth')
+def get_auth_metrics():
+    check_metrics_enabled()
+    return jsonify({
+        'success': True,
+        **auth_metrics()
+    })
+
+
+'''
+GET /metrics/cache
+    It is a public endpoint, only served if METRICS_ENABLED is set.
+    It returns the hit, miss, eviction, expiration and invalidation
+    counters and the size of the response cache of the list endpoints.
+'''
+@APP.route('/metrics/cache')
+def get_cache_metrics():
+    check_metrics_enabled()
+    return jsonify({
+        'success': True,
+        'response_cache': response_cache.stats()
+    })
+
+
+# ---------- CONDITIONAL REQUESTS AND CACHING ----------
+
+response_cache = ResponseCache(
+    maxsize=config.RESPONSE_CACHE_SIZE,
+    max_bytes=config.RESPONSE_CACHE_MAX_BYTES,
+    ttl=config.RESPONSE_CACHE_TTL
+)
+
+
+def conditional(*tables, ttl=None):
+    '''
+    @conditional(*tables, ttl) decorator method
+        @INPUTS
+            tables: the tables the response is built from
+            ttl: how long a cached response is kept, see ResponseCache.put
+        it derives an ETag from the versions of the tables, which every
+            insert, update and delete bumps
+        it answers a matching If-None-Match with 304 Not Modified before
+            the decorated method runs any query or serialization
+        it serves the body from response_cache, keyed by the route, the
+            negotiated format and the query parameters, while the
+            versions are unchanged
+        otherwise it runs the decorated method and caches a successful,
+            non-streamed response
+        it sets the ETag on successful responses, and Vary: Accept as
+            the ETag and body depend on the negotiated format
+    '''
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            versions = TableVersion.get_versions(*tables)
+            response_format = get_format()
+            etag = '-'.join(str(version) for version in versions)
+            if response_format != 'json':
+                etag = f'{etag}-{response_format}'
+
+            if request.if_none_match.contains(etag):
+                response = APP.response_class(status=304)
+                response.set_etag(etag)
+                response.vary.add('Accept')
+                return response
+
+            key = (request.path, response_format,
+                   tuple(sorted(request.args.items(multi=True))))
+            cached = response_cache.get(key, versions)
+            if cached is not None:
+                body, mimetype = cached
+                response = APP.response_class(body, mimetype=mimetype)
+            else:
+                response = APP.make_response(f(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    response_cache.put(key, versions, response.get_data(),
+                                       response.mimetype, ttl=ttl)
+
+            if response.status_code == 200:
+                response.set_etag(etag)
+            response.vary.add('Accept')
+            return response
+
+        return wrapper
+    return conditional_decorator
+
+
+# ---------- PAGINATION ----------
+
+def get_page_args():
+    '''
+    get_page_args() method
+        it reads the after_id and limit query parameters
+            after_id defaults to 0, i.e. the first page
+            limit defaults to config.DEFAULT_PAGE_SIZE
+        it aborts with 400 if either of them is not a valid number
+        return the after_id and limit
+    '''
+    try:
+        after_id = int(request.args.get('after_id', 0))
+        limit = int(request.args.get('limit', config.DEFAULT_PAGE_SIZE))
+    except ValueError:
+        abort(400, description='after_id and limit must be integers.')
+
+    if after_id < 0 or not 0 < limit <= config.MAX_PAGE_SIZE:
+        abort(400, description=f'after_id must not be negative and limit '
+                               f'must be between 1 and {config.MAX_PAGE_SIZE}.')
+
+    return after_id, limit
+
+
+def get_filters(model):
+    '''
+    get_filters(model) method
+        @INPUTS
+            model: the Actor or Movie model
+        it reads the query parameters listed in model.FILTERS
+            eq: the column equals the value
+            min / max: the column is at least / at most the value,
+                which must be a non-negative integer, and a year of
+                four digits for a text column such as release_year
+            prefix: the column starts with the value, ignoring case
+        it aborts with 400 on a bound that is not a valid number
+        return the SQL criteria of the given filters, to be added to
+            the WHERE clause of the query that reads the rows
+    '''
+    criteria = []
+    for param, (field, op) in model.FILTERS.items():
+        value = request.args.get(param)
+        if value is None:
+            continue
+
+        column = getattr(model, field)
+        if op == 'eq':
+            criteria.append(column == value)
+        elif op == 'prefix':
+            # Matches the lower(column) COLLATE "C" index of the model.
+            pattern = value.lower().replace('\\', '\\\\')\
+                .replace('%', '\\%').replace('_', '\\_') + '%'
+            criteria.append(collate(func.lower(column), 'C')
+                            .like(pattern, escape='\\'))
+        else:
+            try:
+                bound = int(value)
+                if bound < 0:
+                    raise ValueError(value)
+            except ValueError:
+                abort(400, description=f'{param} must be a non-negative '
+                                       f'integer.')
+            if column.type.python_type is str:
+                # Years are stored as text, which compares like numbers
+                # only when both sides have four digits, so other values
+                # are left out of the range, as in /stats/decades.
+                if bound > 9999:
+                    abort(400, description=f'{param} must be a year of '
+                                           f'four digits.')
+                bound = f'{bound:04d}'
+                criteria.append(column.op('~')('^[0-9]{4}$'))
+            criteria.append(column >= bound if op == 'min'
+                            else column <= bound)
+    return criteria
+
+
+def paginate(model, relation):
+    '''
+    paginate(model, relation) method
+        @INPUTS
+            model: the Actor or Movie model
+            relation: the relationship that format() embeds
+                (Actor.movies or Movie.actors)
+        it returns one page of rows ordered by primary key, starting after
+            the after_id query parameter (keyset pagination), so a deep
+            page costs the same index range scan as the first one
+        it loads the related rows of the whole page in one IN-query
+            instead of one query per row
+        it fetches one extra row to find out if there is a next page
+        return the rows and the next cursor (None on the last page)
+    '''
+    after_id, limit = get_page_args()
+    rows = model.query\
+        .options(selectinload(relation))\
+        .filter(model.id > after_id, *get_filters(model))\
+        .order_by(model.id)\
+        .limit(limit + 1)\
+        .all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
+
+
+def get_sparse_args(model, relation):
+    '''
+    get_sparse_args(model, relation) method
+        @INPUTS
+            model: the Actor or Movie model
+            relation: the relationship that can be included
+        it reads the fields and include query parameters
+            fields: comma-separated columns of model.FIELDS, the id is
+                always returned
+            include: the name of the relationship to embed
+        it aborts with 400 on an unknown field or include
+        return the fields and whether to include the relationship,
+            or None if neither parameter was given
+    '''
+    fields = request.args.get('fields')
+    include = request.args.get('include')
+    if fields is None and include is None:
+        return None
+
+    if fields is None:
+        fields = model.FIELDS
+    else:
+        fields = tuple(field for field in fields.split(',') if field)
+        unknown = set(fields) - set(model.FIELDS)
+        if unknown:
+            abort(400, description=f'Unknown field(s): '
+                                   f'{", ".join(sorted(unknown))}.')
+        if 'id' not in fields:
+            fields = ('id',) + fields
+
+    if include not in (None, relation.key):
+        abort(400, description=f'Only {relation.key} can be included.')
+
+    return fields, include is not None
+
+
+def paginate_sparse(model, relation, fields, include):
+    '''
+    paginate_sparse(model, relation, fields, include) method
+        @INPUTS
+            model: the Actor or Movie model
+            relation: the relationship that can be included
+            fields: the columns to return
+            include: whether to embed the related rows
+        it returns one page, like paginate(), but selects only the
+            requested columns instead of loading whole ORM objects
+        it queries the roles table only if the relationship is included
+        return the rows as dictionaries and the next cursor
+    '''
+    after_id, limit = get_page_args()
+    rows = db.session.query(*[getattr(model, field) for field in fields])\
+        .filter(model.id > after_id, *get_filters(model))\
+        .order_by(model.id)\
+        .limit(limit + 1)\
+        .all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+
+    rows = [dict(zip(fields, row)) for row in rows]
+    if include:
+        related = load_related(model, relation, [row['id'] for row in rows])
+        for row in rows:
+            row[relation.key] = related.get(row['id'], [])
+
+    return rows, next_cursor
+
+
+def load_related(model, relation, ids):
+    '''
+    load_related(model, relation, ids) method
+        @INPUTS
+            model: the Actor or Movie model
+            relation: the relationship to load
+            ids: the IDs of the rows to load it for
+        it selects the related rows of all the IDs in one query,
+            joining roles with the related table
+        return a dictionary mapping each ID to its related rows,
+            formatted like format_self()
+    '''
+    if not ids:
+        return {}
+
+    related = relation.property.mapper.class_
+    if model is Actor:
+        own_key, related_key = Role.actor_id, Role.movie_id
+    else:
+        own_key, related_key = Role.movie_id, Role.actor_id
+
+    columns = [getattr(related, field) for field in related.SELF_FIELDS]
+    rows = db.session.query(own_key, *columns)\
+        .join(related, related.id == related_key)\
+        .filter(own_key.in_(ids))\
+        .all()
+
+    result = {}
+    for row_id, *values in rows:
+        result.setdefault(row_id, []).append(
+            dict(zip(related.SELF_FIELDS, values)))
+    return result
+
+
+def stream_all(model, relation, key, sparse=None):
+    '''
+    stream_all(model, relation, key, sparse) method
+        @INPUTS
+            model: the Actor or Movie model
+            relation: the relationship that format() embeds
+            key: the name of the list in the response ('actors' or 'movies')
+            sparse: the fields and include returned by get_sparse_args,
+                or None for whole rows
+        it reads every row through a server-side cursor, in chunks of
+            config.STREAM_CHUNK_SIZE rows, loading the related rows of
+            each chunk in one IN-query
+        with sparse fields, it selects only those columns, and loads the
+            related rows only if they are included, like paginate_sparse
+        it writes the JSON response incrementally, one row at a time, so
+            the memory used does not grow with the size of the table
+        return a streamed response with the same shape as a single page
+    '''
+    if sparse is None:
+        query = model.query.options(selectinload(relation))
+    else:
+        fields, include = sparse
+        query = db.session.query(*[getattr(model, field)
+                                   for field in fields])
+    rows = query\
+        .filter(*get_filters(model))\
+        .order_by(model.id)\
+        .yield_per(config.STREAM_CHUNK_SIZE)
+
+    def format_rows():
+        if sparse is None:
+            for row in rows:
+                yield row.format()
+            return
+
+        chunks = iter(rows)
+        while True:
+            chunk = [dict(zip(fields, row)) for row in
+                     islice(chunks, config.STREAM_CHUNK_SIZE)]
+            if not chunk:
+                return
+            if include:
+                related = load_related(model, relation,
+                                       [row['id'] for row in chunk])
+                for row in chunk:
+                    row[relation.key] = related.get(row['id'], [])
+            yield from chunk
+
+    def generate():
+        yield f'{{"success": true, "next": null, "{key}": ['
+        for i, row in enumerate(format_rows()):
+            yield (',' if i else '') + dumps(row)
+        yield ']}\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
+
+
+def get_formatted(model, relation, row_id):
+    '''
+    get_formatted(model, relation, row_id) method
+        @INPUTS
+            model: the Actor or Movie model
+            relation: the relationship that format() embeds
+            row_id: the ID of the row
+        it (re)loads the row together with its related rows in a single
+            query with a JOIN, e.g. after a commit expired them
+        it aborts with 404 if the row was deleted in the meantime
+        return the formatted row
+    '''
+    row = model.query\
+        .options(joinedload(relation))\
+        .populate_existing()\
+        .get(row_id)
+    if row is None:
+        abort(404, description=f'{model.__name__}_id {row_id} not found.')
+    return row.format()
+
+
+# ---------- RESPONSE FORMATS ----------
+
+# Media type of the column-oriented layout of the list endpoints
+COLUMNAR_MIMETYPE = 'application/vnd.casting-agency.columnar+json'
+
+
+def get_format():
+    '''
+    get_format() method
+        it negotiates the response format from the Accept header
+            a client without a preference gets JSON, as before
+        return 'columnar' if COLUMNAR_MIMETYPE is preferred, 'json' otherwise
+    '''
+    best = request.accept_mimetypes.best_match(
+        ['application/json', COLUMNAR_MIMETYPE])
+    return 'columnar' if best == COLUMNAR_MIMETYPE else 'json'
+
+
+def to_columns(rows, fields):
+    '''
+    to_columns(rows, fields) method
+        @INPUTS
+            rows: a list of dictionaries
+            fields: their keys
+        return a dictionary mapping each field to the list of its values
+    '''
+    return {field: [row[field] for row in rows] for field in fields}
+
+
+def list_response(key, relation, rows, next_cursor, fields, include):
+    '''
+    list_response(key, relation, rows, next_cursor, fields, include) method
+        @INPUTS
+            key: the name of the list in the response ('actors' or 'movies')
+            relation: the relationship that can be embedded
+            rows: the page of rows, as dictionaries
+            next_cursor: the after_id of the next page, or None
+            fields: the columns of the rows
+            include: whether the rows embed the related rows
+        it lays the page out in the negotiated format, see get_format()
+            json: a list of objects, one per row
+            columnar: one list of values per column, so each field name
+                appears once per page instead of once per row, and the
+                related rows of each row in the same layout
+        return the JSON response
+    '''
+    if get_format() == 'json':
+        return jsonify({
+            'success': True,
+            key: rows,
+            'next': next_cursor
+        })
+
+    columns = to_columns(rows, fields)
+    if include:
+        related_fields = relation.property.mapper.class_.SELF_FIELDS
+        columns[relation.key] = [to_columns(row[relation.key], related_fields)
+                                 for row in rows]
+
+    response = jsonify({
+        'success': True,
+        key: columns,
+        'next': next_cursor
+    })
+    response.mimetype = COLUMNAR_MIMETYPE
+    return response
+
+
+# ---------- BULK WRITES ----------
+
+def validate_value(model, field, value):
+    '''
+    validate_value(model, field, value) method
+        @INPUTS
+            model: the Actor or Movie model
+            field: one of model.SELF_FIELDS
+            value: the value sent for it, not None
+        it checks the value against the type and length of its column,
+            accepting a number for a text column (e.g. a release year)
+        return the value to write and None, or None and an error message
+    '''
+    column_type = getattr(model, field).type
+    if column_type.python_type is int:
+        if not isinstance(value, int) or isinstance(value, bool) \
+                or value < 0:
+            return None, f'{field} must be a non-negative integer.'
+        return value, None
+
+    if isinstance(value, int) and not isinstance(value, bool):
+        value = str(value)
+    if not isinstance(value, str):
+        return None, f'{field} must be a string.'
+    if len(value) > column_type.length:
+        return None, f'{field} must be at most ' \
+                     f'{column_type.length} characters long.'
+    return value, None
+
+
+def validate_row(model, item):
+    '''
+    validate_row(model, item) method
+        @INPUTS
+            model: the Actor or Movie model
+            item: one element of a bulk request
+        it checks that item is an object with exactly the columns of
+            model.SELF_FIELDS, none of them null, and validates each
+            value with validate_value
+        return the row to insert and None, or None and an error message
+    '''
+    if not isinstance(item, dict):
+        return None, 'Expected an object.'
+
+    unknown = set(item) - set(model.SELF_FIELDS)
+    if unknown:
+        return None, f'Unknown field(s): {", ".join(sorted(unknown))}.'
+
+    row = {}
+    for field in model.SELF_FIELDS:
+        if item.get(field) is None:
+            return None, f'{field} is required.'
+        row[field], error = validate_value(model, field, item[field])
+        if error is not None:
+            return None, error
+    return row, None
+
+
+def validate_values(model, data):
+    '''
+    validate_values(model, data) method
+        @INPUTS
+            model: the Actor or Movie model
+            data: the body of an update
+        it validates the fields of model.SELF_FIELDS given in data with
+            validate_value; other keys and null values are ignored
+        return the values to write and None, or None and an error message
+    '''
+    if not isinstance(data, dict):
+        return None, 'Expected an object.'
+
+    values = {}
+    for field in model.SELF_FIELDS:
+        if data.get(field) is None:
+            continue
+        values[field], error = validate_value(model, field, data[field])
+        if error is not None:
+            return None, error
+    return values, None
+
+
+def update_row(model, relation, row_id):
+    '''
+    update_row(model, relation, row_id) method
+        @INPUTS
+            model: the Actor or Movie model
+            relation: the relationship that format() embeds
+            row_id: the ID of the row to update
+        it validates the body with validate_values, before the database
+            is touched, and aborts with 400 on an invalid value
+        it writes only the given fields, with model.update_fields
+            (a single UPDATE ... RETURNING), and aborts with 404 if no
+            row has this ID
+        return the updated row, formatted like format(), built from the
+            returned columns and the related rows loaded in one query
+    '''
+    values, error = validate_values(model, request.get_json())
+    if error is not None:
+        abort(400, description=error)
+
+    if not values:
+        row = model.query.get(row_id)
+    else:
+        try:
+            row = model.update_fields(row_id, values)
+        except Exception as e:
+            print(e)
+            db.session.rollback()
+            abort(422)
+
+    if row is None:
+        abort(404, description=f'{model.__name__}_id {row_id} not found.')
+
+    formatted = {field: getattr(row, field) for field in model.FIELDS}
+    formatted[relation.key] = load_related(
+        model, relation, [row_id]).get(row_id, [])
+    return formatted
+
+
+def bulk_insert(model):
+    '''
+    bulk_insert(model) method
+        @INPUTS
+            model: the Actor or Movie model
+        it expects a JSON array of up to config.MAX_BULK_SIZE objects
+        it validates every object with validate_row
+            if any of them is invalid, nothing is inserted and a 400
+            response lists the index and error of each invalid object
+        it inserts all the rows with model.insert_many, in one
+            statement and one transaction
+        return the response with the IDs of the new rows
+    '''
+    items = request.get_json()
+    if not isinstance(items, list) or \
+            not 0 < len(items) <= config.MAX_BULK_SIZE:
+        abort(400, description=f'Expected an array of 1 to '
+                               f'{config.MAX_BULK_SIZE} objects.')
+
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+        row, error = validate_row(model, item)
+        if error is not None:
+            errors.append({'index': index, 'message': error})
+        rows.append(row)
+
+    if errors:
+        return jsonify({
+            'success': False,
+            'error': 400,
+            'message': f'{len(errors)} invalid item(s), nothing was created.',
+            'errors': errors
+        }), 400
+
+    try:
+        ids = model.insert_many(rows)
+
+        return jsonify({
+            'success': True,
+            'created': len(ids),
+            'ids': ids
+        })
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        abort(422)
+
+
+def describe_missing(movie_id, actor_ids, default=None):
+    '''
+    describe_missing(movie_id, actor_ids, default) method
+        @INPUTS
+            movie_id: the ID of a movie
+            actor_ids: the IDs of actors
+            default: the description to return if all of the rows exist,
+                e.g. because a missing one was added in the meantime
+        it is only called after a write failed or matched no role, to
+            find out which of the rows does not exist
+        return the description of the 404 response
+    '''
+    if default is None:
+        default = f'Movie_id {movie_id} or one of the actor IDs not found.'
+    if db.session.query(Movie.id).filter(Movie.id == movie_id).scalar() \
+            is None:
+        return f'Movie_id {movie_id} not found.'
+
+    found = {actor_id for actor_id, in db.session.query(Actor.id)
+             .filter(Actor.id.in_(actor_ids))}
+    missing = [actor_id for actor_id in actor_ids if actor_id not in found]
+    if len(missing) == 1:
+        return f'Actor_id {missing[0]} not found.'
+    if missing:
+        return f'Actor_ids {", ".join(map(str, missing))} not found.'
+    return default
+
+
 # ---------- ACTOR ENDPOINTS ----------
 
 '''
 GET /actors
     It requires the 'get:actors' permission.
-    It returns all actors.
+    It returns one page of actors ordered by ID.
+    Query parameters:
+        after_id: return actors with an ID greater than this one
+        limit: maximum number of actors to return
+        stream: 'true' to stream all actors in a single response
+        fields: comma-separated columns to return (id, name, age, gender)
+        include: 'movies' to embed each actor's movies
+        gender: return actors of this gender
+        age_min, age_max: return actors within this age range
+        name: return actors whose name starts with this (any case)
+    If fields or include is given, only the requested columns are
+    selected and movies are embedded only if included, in pages
+    and streams alike.
+    Filters apply to pages and streams alike and are part of the
+    query that reads the rows.
+    The 'next' cursor is the after_id of the next page,
+    or null on the last page.
+    The response carries an ETag; a request with a matching
+    If-None-Match header gets 304 Not Modified.
+    With 'Accept: application/vnd.casting-agency.columnar+json' a page
+    is returned column by column instead of row by row.
 '''
 @APP.route('/actors')
 @requires_auth('get:actors')
+@conditional('actors', 'movies', 'roles')
 def get_actors(payload):
-    actors = Actor.query.order_by(Actor.id).all()
-    actors = [actor.format() for actor in actors]
+    sparse = get_sparse_args(Actor, Actor.movies)
+    if request.args.get('stream') == 'true':
+        if get_format() != 'json':
+            abort(406, description='Streamed responses are only '
+                                   'available as application/json.')
+        return stream_all(Actor, Actor.movies, 'actors', sparse)
 
-    return jsonify({
-        'success': True,
-        'actors': actors
-    })
+    if sparse is not None:
+        fields, include = sparse
+        actors, next_cursor = paginate_sparse(Actor, Actor.movies, *sparse)
+    else:
+        fields, include = Actor.FIELDS, True
+        actors, next_cursor = paginate(Actor, Actor.movies)
+        actors = [actor.format() for actor in actors]
+
+    return list_response('actors', Actor.movies, actors, next_cursor,
+                         fields, include)
 
 
 '''
@@ -77,85 +795,114 @@ def add_new_actor(payload):
         abort(422)
 
 
+'''
+POST /actors/bulk
+    It requires the 'post:actors' permission.
+    It creates many rows in the 'actors' table at once, from a JSON
+    array of objects with the same fields as POST /actors.
+    All of them are inserted in a single statement, or none if any of
+    them is invalid, in which case each error is reported with the
+    index of its object.
+    It returns the IDs of the new actors, in the order of the array.
+'''
+@APP.route('/actors/bulk', methods=['POST'])
+@requires_auth('post:actors')
+def add_new_actors(payload):
+    return bulk_insert(Actor)
+
+
 '''
 PATCH /actors/<actor_id>
     It requires the 'patch:actors' permission.
     It updates an actor with a given ID.
+    Only the fields given in the body are written, with a single
+    UPDATE ... RETURNING statement, see update_row().
 '''
 @APP.route('/actors/<int:actor_id>', methods=['PATCH'])
 @requires_auth('patch:actors')
 def update_actor(payload, actor_id):
-    body = request.get_json()
-    actor = Actor.query.get(actor_id)
-
-    if actor is None:
-        abort(404, description=f'Actor_id {actor_id} not found.')
-
-    try:
-        name = body.get('name', None)
-        age = body.get('age', None)
-        gender = body.get('gender', None)
-
-        if name is not None:
-            actor.name = name
-        if age is not None:
-            actor.age = age
-        if gender is not None:
-            actor.gender = gender
-
-        actor.update()
-
-        return jsonify({
-            'success': True,
-            'actor': actor.format()
-        })
-    except Exception as e:
-        print(e)
-        abort(400)
+    return jsonify({
+        'success': True,
+        'actor': update_row(Actor, Actor.movies, actor_id)
+    })
 
 
 '''
 DELETE /actors/<actor_id>
     It requires the 'delete:actors' permission.
-    It deletes an actor with a given ID.
+    It deletes an actor with a given ID, and its roles, with a
+    single DELETE ... RETURNING statement; the database cascades the
+    delete to the roles.
 '''
 @APP.route('/actors/<int:actor_id>', methods=['DELETE'])
 @requires_auth('delete:actors')
 def delete_actor(payload, actor_id):
-    actor = Actor.query.get(actor_id)
-    if actor is None:
-        abort(404, description=f'Actor_id {actor_id} not found.')
-
     try:
-        if actor is not None:
-            actor.delete()
-
-        return jsonify({
-            'success': True,
-            'actor_id': actor_id
-        })
+        deleted = Actor.delete_by_id(actor_id)
     except Exception as e:
         print(e)
+        db.session.rollback()
         abort(422)
 
+    if not deleted:
+        abort(404, description=f'Actor_id {actor_id} not found.')
+
+    return jsonify({
+        'success': True,
+        'actor_id': actor_id
+    })
+
 
 # ---------- MOVIE ENDPOINTS ----------
 
 '''
 GET /movies
     It requires the 'get:movies' permission.
-    It returns all movies.
+    It returns one page of movies ordered by ID.
+    Query parameters:
+        after_id: return movies with an ID greater than this one
+        limit: maximum number of movies to return
+        stream: 'true' to stream all movies in a single response
+        fields: comma-separated columns to return
+            (id, title, release_year, genre)
+        include: 'actors' to embed each movie's actors
+        genre: return movies of this genre
+        release_year_min, release_year_max: return movies released
+            within this range of years
+        title: return movies whose title starts with this (any case)
+    If fields or include is given, only the requested columns are
+    selected and actors are embedded only if included, in pages
+    and streams alike.
+    Filters apply to pages and streams alike and are part of the
+    query that reads the rows.
+    The 'next' cursor is the after_id of the next page,
+    or null on the last page.
+    The response carries an ETag; a request with a matching
+    If-None-Match header gets 304 Not Modified.
+    With 'Accept: application/vnd.casting-agency.columnar+json' a page
+    is returned column by column instead of row by row.
 '''
 @APP.route('/movies')
 @requires_auth('get:movies')
+@conditional('actors', 'movies', 'roles')
 def get_movies(payload):
-    movies = Movie.query.order_by(Movie.id).all()
-    movies = [movie.format() for movie in movies]
+    sparse = get_sparse_args(Movie, Movie.actors)
+    if request.args.get('stream') == 'true':
+        if get_format() != 'json':
+            abort(406, description='Streamed responses are only '
+                                   'available as application/json.')
+        return stream_all(Movie, Movie.actors, 'movies', sparse)
 
-    return jsonify({
-        'success': True,
-        'movies': movies
-    })
+    if sparse is not None:
+        fields, include = sparse
+        movies, next_cursor = paginate_sparse(Movie, Movie.actors, *sparse)
+    else:
+        fields, include = Movie.FIELDS, True
+        movies, next_cursor = paginate(Movie, Movie.actors)
+        movies = [movie.format() for movie in movies]
+
+    return list_response('movies', Movie.actors, movies, next_cursor,
+                         fields, include)
 
 
 '''
@@ -187,145 +934,518 @@ def add_new_movie(payload):
         abort(422)
 
 
+'''
+POST /movies/bulk
+    It requires the 'post:movies' permission.
+    It creates many rows in the 'movies' table at once, see
+    POST /actors/bulk.
+'''
+@APP.route('/movies/bulk', methods=['POST'])
+@requires_auth('post:movies')
+def add_new_movies(payload):
+    return bulk_insert(Movie)
+
+
 '''
 PATCH /movies/<movie_id>
     It requires the 'patch:movies' permission.
     It updates a movie with a given ID.
+    Only the fields given in the body are written, with a single
+    UPDATE ... RETURNING statement, see update_row().
 '''
 @APP.route('/movies/<int:movie_id>', methods=['PATCH'])
 @requires_auth('patch:movies')
 def update_movie(payload, movie_id):
-    body = request.get_json()
-    movie = Movie.query.get(movie_id)
-
-    if movie is None:
-        abort(404, description=f'Movie_id {movie_id} not found.')
-
-    try:
-        title = body.get('title', None)
-        release_year = body.get('release_year', None)
-        genre = body.get('genre', None)
-
-        if title is not None:
-            movie.title = title
-        if release_year is not None:
-            movie.release_year = release_year
-        if genre is not None:
-            movie.genre = genre
-
-        movie.update()
-
-        return jsonify({
-            'success': True,
-            'movie': movie.format()
-        })
-    except Exception as e:
-        print(e)
-        abort(400)
+    return jsonify({
+        'success': True,
+        'movie': update_row(Movie, Movie.actors, movie_id)
+    })
 
 
 '''
 DELETE /movies/<movie_id>
     It requires the 'delete:movies' permission.
-    It deletes a movie with a given ID.
+    It deletes a movie with a given ID, and its roles, with a
+    single DELETE ... RETURNING statement; the database cascades the
+    delete to the roles.
 '''
 @APP.route('/movies/<int:movie_id>', methods=['DELETE'])
 @requires_auth('delete:movies')
 def delete_movie(payload, movie_id):
-    movie = Movie.query.get(movie_id)
-    if movie is None:
-        abort(404, description=f'Movie_id {movie_id} not found.')
-
     try:
-        if movie is not None:
-            movie.delete()
-
-        return jsonify({
-            'success': True,
-            'movie_id': movie_id
-        })
+        deleted = Movie.delete_by_id(movie_id)
     except Exception as e:
         print(e)
+        db.session.rollback()
         abort(422)
 
+    if not deleted:
+        abort(404, description=f'Movie_id {movie_id} not found.')
+
+    return jsonify({
+        'success': True,
+        'movie_id': movie_id
+    })
+
 
 '''
 POST /movies/<movie_id>/actors
     It requires the 'post:movies' permission.
-    It ...
+    It casts actors in the movie with a given ID.
+    The body holds either a single 'actor_id', or a list of
+    'actor_ids' to cast them all at once.
+    All the new roles are inserted in one statement, without looking
+    the movie or actors up first; actors that already have a role in
+    the movie are skipped and listed in 'skipped' (a single 'actor_id'
+    with a role gets 409 instead).
+    If the movie or any of the actors does not exist, the foreign keys
+    reject the statement, none is cast and 404 is returned.
 '''
 @APP.route('/movies/<int:movie_id>/actors', methods=['POST'])
 @requires_auth('post:movies')
 def add_actor_to_movie(payload, movie_id):
     body = request.get_json()
-    if not body or not body.get('actor_id'):
-        abort(400, description='The actor_id attribute must be specified.')
-    actor_id = body['actor_id']
-
-    movie = Movie.query.get(movie_id)
-    if not movie:
-        abort(404, description=f'Movie_id {movie_id} not found.')
-
-    actor = Actor.query.get(actor_id)
-    if not actor:
-        abort(404, description=f'Actor_id {actor_id} not found.')
-
-    existing_role = Role.query.filter(
-        (Role.movie_id == movie_id) & (Role.actor_id == actor_id))\
-        .one_or_none()
-    if existing_role:
-        abort(409, description=f'actor_id {actor_id} \
-            already has a role in movie_id {movie_id}')
+    single = bool(body and body.get('actor_id'))
+    if single:
+        actor_ids = [body['actor_id']]
+    elif body and body.get('actor_ids'):
+        actor_ids = body['actor_ids']
+        if not isinstance(actor_ids, list) or \
+                len(actor_ids) > config.MAX_BULK_SIZE:
+            abort(400, description=f'actor_ids must be a list of at most '
+                                   f'{config.MAX_BULK_SIZE} IDs.')
+    else:
+        abort(400, description='The actor_id or actor_ids attribute must '
+                               'be specified.')
+
+    if not all(isinstance(actor_id, int) and not isinstance(actor_id, bool)
+               for actor_id in actor_ids):
+        abort(400, description='Actor IDs must be integers.')
+    actor_ids = list(dict.fromkeys(actor_ids))
 
     try:
-        role = Role(movie_id=movie_id, actor_id=actor_id)
-        role.insert()
-
-        return jsonify({
-            'success': True,
-            'movie': movie.format()
-        })
+        added = Role.insert_many(movie_id, actor_ids)
+    except IntegrityError as e:
+        db.session.rollback()
+        if e.orig.pgcode != errorcodes.FOREIGN_KEY_VIOLATION:
+            print(e)
+            abort(422)
+        abort(404, description=describe_missing(movie_id, actor_ids))
     except Exception as e:
         print(e)
+        db.session.rollback()
         abort(422)
 
+    skipped = [actor_id for actor_id in actor_ids if actor_id not in added]
+    if single and skipped:
+        abort(409, description=f'actor_id {actor_ids[0]} \
+            already has a role in movie_id {movie_id}')
+
+    return jsonify({
+        'success': True,
+        'movie': get_formatted(Movie, Movie.actors, movie_id),
+        'added': added,
+        'skipped': skipped
+    })
+
 
 '''
 DELETE /movies/<movie_id>/actors/<actor_id>
     It requires the 'delete:movies' permission.
-    It ...
+    It removes the actor with a given ID from the cast of the movie
+    with a given ID, with a single DELETE ... RETURNING statement.
+    If no role was deleted, it returns 404, naming the movie or actor
+    that does not exist, if any.
 '''
 @APP.route('/movies/<int:movie_id>/actors/<int:actor_id>', methods=['DELETE'])
 @requires_auth('delete:movies')
 def delete_actor_from_movie(payload, movie_id, actor_id):
-    movie = Movie.query.get(movie_id)
-    if not movie:
-        abort(404, description=f'Movie_id {movie_id} not found.')
+    try:
+        deleted = Role.delete_one(movie_id, actor_id)
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        abort(422)
 
-    actor = Actor.query.get(actor_id)
-    if not actor:
-        abort(404, description=f'Actor_id {actor_id} not found.')
+    if not deleted:
+        abort(404, description=describe_missing(
+            movie_id, [actor_id], f'actor_id {actor_id} \
+            does not have a role in movie_id {movie_id}'))
 
-    role = Role.query.filter(
-        (Role.movie_id == movie_id) &
-        (Role.actor_id == actor_id)).one_or_none()
-    if not role:
-        abort(404, description=f'actor_id {actor_id} \
-            does not have a role in movie_id {movie_id}')
+    return jsonify({
+        'success': True,
+        'movie_id': movie_id,
+        'actor_id': actor_id
+    })
 
-    try:
-        if role is not None:
-            role.delete()
 
-        return jsonify({
-            'success': True,
+# ---------- BATCH ENDPOINT ----------
+
+# The permission each batch operation requires, as its own endpoint does
+BATCH_PERMISSIONS = {
+    ('create', 'actors'): 'post:actors',
+    ('update', 'actors'): 'patch:actors',
+    ('delete', 'actors'): 'delete:actors',
+    ('create', 'movies'): 'post:movies',
+    ('update', 'movies'): 'patch:movies',
+    ('delete', 'movies'): 'delete:movies',
+    ('link', 'movies'): 'post:movies'
+}
+BATCH_MODELS = {'actors': Actor, 'movies': Movie}
+
+
+def check_batch_id(value, resource, refs):
+    '''
+    check_batch_id(value, resource, refs) method
+        @INPUTS
+            value: an ID in a batch operation, either an integer or
+                '$name' for the ID created by an earlier operation
+                with "ref": "name"
+            resource: 'actors' or 'movies', what the ID must be of
+            refs: the resource of each ref defined by the earlier
+                operations, by name
+        it aborts with 400 if the value is neither, or is the ref of
+            another resource
+    '''
+    if isinstance(value, int) and not isinstance(value, bool):
+        return
+    if isinstance(value, str) and value.startswith('$') and \
+            refs.get(value[1:]) == resource:
+        return
+    abort(400, description=f'{value!r} is neither an ID nor the ref of '
+                           f'an earlier create operation of {resource}.')
+
+
+def check_batch_operation(operation, refs, payload):
+    '''
+    check_batch_operation(operation, refs, payload) method
+        @INPUTS
+            operation: one element of the operations of a batch
+            refs: the resource of each ref defined by the earlier
+                operations, by name, to which the ref of this operation
+                is added
+            payload: the decoded jwt payload of the request
+        it checks the shape of the operation, the permission its own
+            endpoint requires, its IDs and refs, and validates its data
+            with validate_row or validate_values
+        it aborts with the status code the endpoint would return
+        return the operation, with its data validated
+    '''
+    if not isinstance(operation, dict):
+        abort(400, description='Expected an object.')
+
+    op = operation.get('op')
+    resource = 'movies' if op == 'link' else operation.get('resource')
+    if (op, resource) not in BATCH_PERMISSIONS:
+        abort(400, description='op must be create, update, delete or link, '
+                               'and resource actors or movies.')
+
+    try:
+        check_permissions(BATCH_PERMISSIONS[(op, resource)], payload)
+    except AuthError as e:
+        abort(e.status_code, description=e.error['description'])
+
+    model = BATCH_MODELS[resource]
+    checked = {'op': op, 'model': model}
+    if op == 'create':
+        checked['row'], error = validate_row(model, operation.get('data'))
+        if error is not None:
+            abort(400, description=error)
+    elif op == 'update':
+        values, error = validate_values(model, operation.get('data'))
+        if error is not None:
+            abort(400, description=error)
+        if not values:
+            abort(400, description='Nothing to update.')
+        checked['values'] = values
+
+    if op in ('update', 'delete'):
+        check_batch_id(operation.get('id'), resource, refs)
+        checked['id'] = operation['id']
+    elif op == 'link':
+        actor_ids = operation.get('actor_ids')
+        if not isinstance(actor_ids, list) or not actor_ids:
+            abort(400, description='actor_ids must be a non-empty list.')
+        check_batch_id(operation.get('movie_id'), 'movies', refs)
+        for value in actor_ids:
+            check_batch_id(value, 'actors', refs)
+        checked['movie_id'] = operation['movie_id']
+        checked['actor_ids'] = actor_ids
+
+    ref = operation.get('ref')
+    if ref is not None:
+        if op != 'create' or not isinstance(ref, str) or ref in refs:
+            abort(400, description='Only create operations can have a '
+                                   'ref, which must be a new string.')
+        refs[ref] = resource
+        checked['ref'] = ref
+    return checked
+
+
+def run_batch_operation(operation, ids, tables):
+    '''
+    run_batch_operation(operation, ids, tables) method
+        @INPUTS
+            operation: an operation checked by check_batch_operation
+            ids: the IDs created so far in the batch, by ref
+            tables: the tables written so far in the batch, to which
+                those written by this operation are added
+        it writes the operation without committing, and without bumping
+            the table versions, which run_batch does once for all the
+            operations
+        it aborts with the status code the endpoint would return
+        return the result of the operation
+    '''
+    def resolve(value):
+        return ids[value[1:]] if isinstance(value, str) else value
+
+    op, model = operation['op'], operation['model']
+    if op == 'create':
+        row_id, = model.insert_many([operation['row']], commit=False,
+                                    bump=False)
+        tables.add(model.__tablename__)
+        if 'ref' in operation:
+            ids[operation['ref']] = row_id
+        return {'id': row_id}
+
+    if op == 'link':
+        movie_id = resolve(operation['movie_id'])
+        actor_ids = list(dict.fromkeys(
+            resolve(value) for value in operation['actor_ids']))
+        try:
+            with db.session.begin_nested():
+                added = Role.insert_many(movie_id, actor_ids, commit=False,
+                                         bump=False)
+        except IntegrityError as e:
+            if e.orig.pgcode != errorcodes.FOREIGN_KEY_VIOLATION:
+                raise
+            abort(404, description=describe_missing(movie_id, actor_ids))
+        if added:
+            tables.add('roles')
+        return {
             'movie_id': movie_id,
-            'actor_id': actor_id
-        })
+            'added': added,
+            'skipped': [actor_id for actor_id in actor_ids
+                        if actor_id not in added]
+        }
+
+    row_id = resolve(operation['id'])
+    if op == 'update':
+        found = model.update_fields(row_id, operation['values'],
+                                    commit=False, bump=False) is not None
+        written = (model.__tablename__,)
+    else:
+        found = model.delete_by_id(row_id, commit=False, bump=False)
+        written = (model.__tablename__, 'roles')
+    if not found:
+        abort(404, description=f'{model.__name__}_id {row_id} not found.')
+    tables.update(written)
+    return {'id': row_id}
+
+
+def batch_error(index, error):
+    return jsonify({
+        'success': False,
+        'error': error.code,
+        'message': error.description,
+        'index': index
+    }), error.code
+
+
+'''
+POST /batch
+    It requires the permission of each of its operations, as the
+    endpoint of that operation would.
+    It runs an ordered list of operations, given as the body or as its
+    "operations" key, in a single transaction:
+        {"op": "create", "resource": "actors" | "movies",
+            "data": {...}, "ref": "name"}
+        {"op": "update", "resource": ..., "id": ..., "data": {...}}
+        {"op": "delete", "resource": ..., "id": ...}
+        {"op": "link", "movie_id": ..., "actor_ids": [...]}
+    An ID can be '$name' for the ID created by an earlier create
+    operation with "ref": "name".
+    All operations are checked before any of them runs. If one of them
+    fails, none is applied, and the error gets the index of the
+    operation.
+    It returns the result of each operation, in order.
+'''
+@APP.route('/batch', methods=['POST'])
+@requires_auth(None)
+def run_batch(payload):
+    body = request.get_json()
+    operations = body.get('operations') if isinstance(body, dict) else body
+    if not isinstance(operations, list) or \
+            not 0 < len(operations) <= config.MAX_BULK_SIZE:
+        abort(400, description=f'operations must be a list of 1 to '
+                               f'{config.MAX_BULK_SIZE} operations.')
+
+    checked = []
+    refs = {}
+    for index, operation in enumerate(operations):
+        try:
+            checked.append(check_batch_operation(operation, refs, payload))
+        except HTTPException as e:
+            return batch_error(index, e)
+
+    results = []
+    ids = {}
+    tables = set()
+    for index, operation in enumerate(checked):
+        try:
+            results.append(run_batch_operation(operation, ids, tables))
+        except HTTPException as e:
+            db.session.rollback()
+            return batch_error(index, e)
+        except Exception as e:
+            print(e)
+            db.session.rollback()
+            abort(422)
+
+    try:
+        # The versions are bumped last, in one statement that locks their
+        # rows in name order, so concurrent batches cannot deadlock on
+        # them and hold them only until the commit.
+        if tables:
+            TableVersion.bump(*tables)
+        db.session.commit()
     except Exception as e:
         print(e)
+        db.session.rollback()
         abort(422)
 
+    return jsonify({
+        'success': True,
+        'results': results
+    })
+
+
+# ---------- STATS ENDPOINTS ----------
+
+'''
+GET /stats/genres
+    It requires the 'get:movies' permission.
+    It returns the number of movies of each genre, most frequent first.
+    The counts are computed in the database with one GROUP BY query
+    and cached until the next write, like the list endpoints.
+'''
+@APP.route('/stats/genres')
+@requires_auth('get:movies')
+@conditional('movies', ttl=math.inf)
+def get_genre_stats(payload):
+    count = func.count(Movie.id)
+    rows = db.session.query(Movie.genre, count)\
+        .group_by(Movie.genre)\
+        .order_by(count.desc(), Movie.genre)\
+        .all()
+
+    return jsonify({
+        'success': True,
+        'genres': [{'genre': genre, 'movies': movies}
+                   for genre, movies in rows]
+    })
+
+
+'''
+GET /stats/decades
+    It requires the 'get:movies' permission.
+    It returns the number of movies released in each decade, in order.
+    Movies whose release year is not a four-digit year are left out.
+    The counts are computed in the database with one GROUP BY query
+    and cached until the next write.
+'''
+@APP.route('/stats/decades')
+@requires_auth('get:movies')
+@conditional('movies', ttl=math.inf)
+def get_decade_stats(payload):
+    decade = (cast(Movie.release_year, Integer) / 10 * 10).label('decade')
+    rows = db.session.query(decade, func.count(Movie.id))\
+        .filter(Movie.release_year.op('~')('^[0-9]{4}$'))\
+        .group_by(decade)\
+        .order_by(decade)\
+        .all()
+
+    return jsonify({
+        'success': True,
+        'decades': [{'decade': decade, 'movies': movies}
+                    for decade, movies in rows]
+    })
+
+
+'''
+GET /stats/actors-per-movie
+    It requires the 'get:movies' permission.
+    It returns the number of actors cast in each movie, one page of
+    movies at a time, ordered by ID, with the same after_id and limit
+    query parameters and 'next' cursor as GET /movies.
+    The counts are computed in the database with one GROUP BY query
+    and cached until the next write.
+'''
+@APP.route('/stats/actors-per-movie')
+@requires_auth('get:movies')
+@conditional('movies', 'roles', ttl=math.inf)
+def get_actors_per_movie_stats(payload):
+    after_id, limit = get_page_args()
+    rows = db.session.query(Movie.id, Movie.title, func.count(Role.actor_id))\
+        .outerjoin(Role, Role.movie_id == Movie.id)\
+        .filter(Movie.id > after_id)\
+        .group_by(Movie.id)\
+        .order_by(Movie.id)\
+        .limit(limit + 1)\
+        .all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+
+    return jsonify({
+        'success': True,
+        'movies': [{'id': movie_id, 'title': title, 'actors': actors}
+                   for movie_id, title, actors in rows],
+        'next': next_cursor
+    })
+
+
+'''
+GET /stats/cast-age-by-genre
+    It requires the 'get:actors' permission.
+    It returns, for each genre, how many actors are cast in movies of
+    that genre and the minimum, median, average and maximum of their
+    ages. An actor cast in several movies of a genre counts once per
+    movie; actors without an age are counted but not in the ages.
+    The figures are computed in the database with one GROUP BY query
+    and cached until the next write.
+'''
+@APP.route('/stats/cast-age-by-genre')
+@requires_auth('get:actors')
+@conditional('actors', 'movies', 'roles', ttl=math.inf)
+def get_cast_age_stats(payload):
+    rows = db.session.query(
+            Movie.genre,
+            func.count(Actor.id),
+            func.min(Actor.age),
+            func.percentile_cont(0.5).within_group(Actor.age),
+            func.avg(Actor.age),
+            func.max(Actor.age))\
+        .join(Role, Role.movie_id == Movie.id)\
+        .join(Actor, Actor.id == Role.actor_id)\
+        .group_by(Movie.genre)\
+        .order_by(Movie.genre)\
+        .all()
+
+    return jsonify({
+        'success': True,
+        'genres': [{
+            'genre': genre,
+            'cast': cast_size,
+            'min_age': min_age,
+            'median_age': None if median is None else float(median),
+            'avg_age': None if avg is None else round(float(avg), 2),
+            'max_age': max_age
+        } for genre, cast_size, min_age, median, avg, max_age in rows]
+    })
+
 
 # ---------- ERROR HANDLING ----------
 
@@ -378,6 +1498,15 @@ def method_not_allowed(error):
     }), 405
 
 
+@APP.errorhandler(406)
+def not_acceptable(error):
+    return jsonify({
+        'success': False,
+        'error': 406,
+        'message': error.description
+    }), 406
+
+
 @APP.errorhandler(409)
 def resource_conflict(error):
     return jsonify({
@@ -1,15 +1,69 @@
-import json
-from flask import current_app, request, _request_ctx_stack, abort
-from functools import wraps
+from flask import current_app, request, _request_ctx_stack, abort, \
+    after_this_request
+from functools import partial, wraps
 from jose import jwt
-from urllib.request import urlopen
 from config import auth0_config
+from .jwks import JWKSCache
+from .timing import AuthTiming
+from .token_cache import TokenCache
 
 
 AUTH0_DOMAIN = auth0_config['AUTH0_DOMAIN']
 ALGORITHMS = auth0_config['ALGORITHMS']
 API_AUDIENCE = auth0_config['API_AUDIENCE']
 
+jwks_cache = JWKSCache(
+    auth0_config['JWKS_URL'],
+    ttl=auth0_config['JWKS_CACHE_TTL'],
+    algorithm=ALGORITHMS[0],
+    cache_file=auth0_config['JWKS_CACHE_FILE']
+)
+token_cache = TokenCache(maxsize=auth0_config['TOKEN_CACHE_SIZE'])
+auth_timing = AuthTiming(enabled=auth0_config['AUTH_TIMING'])
+
+
+def setup_auth(app):
+    '''
+    setup_auth(app) method
+        @INPUTS
+            app: the Flask application
+        it starts the background refresher, which loads the JWKS at once
+            and keeps it fresh, so request threads never fetch it
+            themselves, and GET /ready reports 503 until it is loaded
+        it is called once per serving process, after it is forked (see
+            post_worker_init in gunicorn.conf.py), never at import time,
+            so flask CLI commands and tests neither fetch the JWKS nor
+            start a thread
+        it is skipped if JWKS_PREFETCH is turned off or the app is
+            testing, and request threads then fetch the JWKS on demand
+        return the refresher thread, or None if it is skipped
+    '''
+    if app.testing or not app.config.get(
+            'JWKS_PREFETCH', auth0_config['JWKS_PREFETCH']):
+        return None
+
+    return jwks_cache.start_refresher()
+
+
+def auth_ready():
+    '''
+    auth_ready() method
+        return True once the token verification keys are loaded
+    '''
+    return jwks_cache.ready
+
+
+def auth_metrics():
+    '''
+    auth_metrics() method
+        return the token cache counters and the per-phase timing
+            histograms of requires_auth
+    '''
+    return {
+        'token_cache': token_cache.stats(),
+        'timing': auth_timing.snapshot()
+    }
+
 
 # AuthError Exception
 class AuthError(Exception):
@@ -22,6 +76,23 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+# Verified Payload
+class VerifiedPayload(dict):
+    '''
+    VerifiedPayload
+    A decoded jwt payload, as returned by verify_decode_jwt
+        its permissions are compiled once into an immutable set, which is
+            cached together with the payload, so check_permissions is a
+            single set lookup for every request made with the same token
+        permission_set is None if the payload has no permissions claim
+    '''
+    def __init__(self, payload):
+        super().__init__(payload)
+        permissions = payload.get('permissions')
+        self.permission_set = None if permissions is None \
+            else frozenset(permissions)
+
+
 # Auth Header
 
 # Obtains the Access Token from the Authorization Header
@@ -72,16 +143,19 @@ def check_permissions(permission, payload):
             payload: decoded jwt payload
         it raises an AuthError if permissions are not included in the payload
         it raises an AuthError if the requested permission string is
-            not in the payload permissions array
+            not in the payload permissions set
         return true otherwise
     '''
-    if 'permissions' not in payload:
+    if not isinstance(payload, VerifiedPayload):
+        payload = VerifiedPayload(payload)
+
+    if payload.permission_set is None:
         raise AuthError({
             'code': 'invalid_claims',
             'description': 'Permissions not included in JWT.'
         }, 400)
 
-    if permission not in payload['permissions']:
+    if permission not in payload.permission_set:
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found.'
@@ -90,21 +164,30 @@ def check_permissions(permission, payload):
     return True
 
 
-def verify_decode_jwt(token):
+def verify_decode_jwt(token, timer=None):
     '''
-    verify_decode_jwt(token) method
+    verify_decode_jwt(token, timer) method
         @INPUTS
             token: a json web token (string)
+            timer: an optional PhaseTimer, see auth_timing
+        it returns the cached payload if the token was verified before
+            and has not expired yet
         it is an Auth0 token with key id (kid)
-        it verifies the token using Auth0 /.well-known/jwks.json
+        it verifies the token using Auth0 /.well-known/jwks.json,
+            served from the process-wide jwks_cache as public keys
+            already parsed and indexed by kid
         it decodes the payload from the token
         it validates the claims
-        return the decoded payload
+        it caches the decoded payload until the token expires
+        return the decoded payload as a VerifiedPayload
     '''
-    json_url = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(json_url.read())
+    payload = token_cache.get(token)
+    if timer is not None:
+        timer.lap('token_cache')
+    if payload is not None:
+        return payload
+
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
 
     if 'kid' not in unverified_header:
         raise AuthError({
@@ -112,25 +195,22 @@ def verify_decode_jwt(token):
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-
-    if rsa_key:
+    kid = unverified_header['kid']
+    public_key = jwks_cache.get_key(kid)
+    if timer is not None:
+        timer.lap('jwks')
+
+    if public_key is not None:
         try:
-            payload = jwt.decode(
+            # A {kid: key} mapping lets jose use the pre-parsed key as is.
+            payload = VerifiedPayload(jwt.decode(
                 token,
-                rsa_key,
+                {kid: public_key},
                 algorithms=ALGORITHMS,
                 audience=API_AUDIENCE,
                 issuer='https://' + AUTH0_DOMAIN + '/'
-            )
+            ))
+            token_cache.put(token, payload)
             return payload
 
         except jwt.ExpiredSignatureError:
@@ -152,30 +232,59 @@ def verify_decode_jwt(token):
                 'description': 'Unable to parse authentication token.'
             }, 401)
 
+        finally:
+            if timer is not None:
+                timer.lap('verify')
+
     raise AuthError({
         'code': 'invalid_header',
         'description': 'Unable to find the appropriate key.'
     }, 401)
 
 
+def finish_auth_timing(timer, response):
+    '''
+    finish_auth_timing(timer, response) method
+        @INPUTS
+            timer: the PhaseTimer of the current request
+            response: the response about to be sent
+        it adds the timer's phases to the auth_timing histograms
+        it exports them in the Server-Timing response header
+        return the response
+    '''
+    auth_timing.record(timer)
+    if timer.phases:
+        response.headers.add('Server-Timing', timer.server_timing())
+    return response
+
+
 def requires_auth(permission=''):
     '''
     @requires_auth(permission) decorator method
         @INPUTS
-            permission: string permission (i.e. 'post:drink')
+            permission: string permission (i.e. 'post:drink'), or None
+                for a method that checks permissions itself
         it uses the get_token_auth_header method to get the token
         it uses the verify_decode_jwt method to decode the jwt
         it uses the check_permissions method validate claims
-            and check the requested permission
+            and check the requested permission, unless it is None
+        it times each of these phases if auth_timing is enabled
         return the decorator which passes the decoded payload
             to the decorated method
     '''
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
+            timer = auth_timing.start()
+            if timer is not None:
+                after_this_request(partial(finish_auth_timing, timer))
+
             token = get_token_auth_header()
+            if timer is not None:
+                timer.lap('header')
+
             try:
-                payload = verify_decode_jwt(token)
+                payload = verify_decode_jwt(token, timer)
             except AuthError as e:
                 abort(e.status_code)
             except Exception as e:
@@ -183,9 +292,13 @@ def requires_auth(permission=''):
                 abort(401)
 
             try:
-                check_permissions(permission, payload)
+                if permission is not None:
+                    check_permissions(permission, payload)
             except AuthError as e:
                 abort(e.status_code)
+            finally:
+                if timer is not None:
+                    timer.lap('permissions')
 
             return f(payload, *args, **kwargs)
 
@@ -0,0 +1,411 @@
+import json
+import os
+import random
+import stat
+import tempfile
+import threading
+import time
+from urllib.request import urlopen
+
+from jose import jwk
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+# Don't follow a symlink planted in place of the cache or lock file.
+O_NOFOLLOW = getattr(os, 'O_NOFOLLOW', 0)
+
+
+def check_private(st, path):
+    '''
+    check_private(st, path) method
+        @INPUTS
+            st: the os.stat_result of a file or directory
+            path: its path, for the error message
+        it raises an OSError unless it is owned by the current user and
+            not writable by the group or others, since anyone who can
+            write the cache file can make tokens signed with their own
+            key verify
+    '''
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        raise OSError(f'{path} is not owned by the current user.')
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise OSError(f'{path} is writable by other users.')
+
+
+class _Flight:
+    '''
+    A refresh in progress, shared by every thread that asked for it
+    '''
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class JWKSCache:
+    '''
+    JWKSCache
+    A process-wide cache of the JSON Web Key Set used to verify tokens
+        the JWKS is fetched from `url` and considered fresh for `ttl` seconds
+        every signing key is parsed once, when the JWKS is loaded, into
+            a ready-to-use public key object indexed by its key id (kid)
+        a stale JWKS keeps being served while a background thread
+            refreshes it (stale-while-revalidate), so a slow or failing
+            upstream never blocks a request that already has keys
+        an unknown key id (kid) forces a synchronous refresh, at most once
+            every `min_refresh_interval` seconds
+        concurrent refreshes are coalesced: one thread fetches while the
+            others wait for its result
+        with a `cache_file`, the JWKS is also shared on disk by every
+            process on the host: a fresh copy there is used instead of
+            fetching, and a file lock lets only one process fetch at a time;
+            its directory is created private (0700), and the directory,
+            file and lock are only used if they are owned by the current
+            user and not writable by others
+        once the background refresher is started, request threads never
+            fetch: keys are refreshed ahead of expiry and unknown key ids
+            or a missing JWKS only schedule a background refresh
+    '''
+    def __init__(self, url, ttl=600, min_refresh_interval=30, timeout=5,
+                 algorithm='RS256', cache_file=None, clock=time.monotonic):
+        self.url = url
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.algorithm = algorithm
+        self.clock = clock
+        self._jwks = None
+        self._keys = None
+        self._fetched_at = None
+        self._revalidating = False
+        self._failed_at = None
+        self._flight = None
+        self._refresher = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        '''
+        True once the keys have been loaded
+        '''
+        return self._keys is not None
+
+    @property
+    def blocking(self):
+        '''
+        True while request threads may fetch the JWKS themselves
+        '''
+        return self._refresher is None
+
+    def fetch(self):
+        '''
+        fetch() method
+            it downloads and parses the JWKS from the upstream URL
+            return the JWKS dictionary
+        '''
+        with urlopen(self.url, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def parse_keys(self, jwks):
+        '''
+        parse_keys(jwks) method
+            @INPUTS
+                jwks: a JWKS dictionary
+            it skips keys that are not signing keys or cannot be parsed
+            return a dictionary mapping each kid to its public key object
+        '''
+        keys = {}
+        for key in jwks['keys']:
+            if 'kid' not in key or key.get('use', 'sig') != 'sig':
+                continue
+            try:
+                keys[key['kid']] = jwk.construct(
+                    key, key.get('alg', self.algorithm)).prepared_key
+            except Exception as e:
+                print(e)
+        return keys
+
+    def refresh(self, max_age=None):
+        '''
+        refresh() method
+            @INPUTS
+                max_age: how old (in seconds) a copy in the cache file may be
+                    to be used instead of fetching, defaults to the ttl
+            it waits for the refresh already in progress, if there is one
+            otherwise it loads the JWKS, parses its keys and replaces the
+                cached copy
+            return the new JWKS
+        '''
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return self._jwks
+
+        try:
+            jwks, age = self._load(self.ttl if max_age is None else max_age)
+            keys = self.parse_keys(jwks)
+            with self._lock:
+                self._jwks = jwks
+                self._keys = keys
+                self._fetched_at = self.clock() - age
+            return jwks
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flight = None
+            flight.done.set()
+
+    def get_jwks(self):
+        '''
+        get_jwks() method
+            return the cached JWKS, see get_keys()
+        '''
+        self.get_keys()
+        return self._jwks
+
+    def get_keys(self):
+        '''
+        get_keys() method
+            it fetches the JWKS synchronously if nothing is cached yet
+            it starts a background refresh if the cached JWKS is stale
+            return the cached kid -> public key dictionary
+        '''
+        keys, fetched_at = self._keys, self._fetched_at
+        if keys is None:
+            if not self.blocking:
+                self._revalidate()
+                return {}
+            self.refresh()
+            return self._keys
+
+        if self.clock() - fetched_at >= self.ttl:
+            self._revalidate()
+        return keys
+
+    def get_key(self, kid):
+        '''
+        get_key(kid) method
+            @INPUTS
+                kid: the key id from the token header
+            it looks the key up in the cached keys
+            it refreshes the JWKS once if the key id is unknown, in the
+                background if the refresher is running
+            return the matching public key object, or None if there is none
+        '''
+        key = self.get_keys().get(kid)
+        if key is None and self._may_force_refresh():
+            if not self.blocking:
+                self._revalidate(max_age=self.min_refresh_interval)
+                return None
+            self.refresh(max_age=self.min_refresh_interval)
+            key = self._keys.get(kid)
+        return key
+
+    def prefetch(self):
+        '''
+        prefetch() method
+            it loads the JWKS ahead of the first request
+            it only logs failures, the refresher keeps retrying
+            return True if the keys are loaded
+        '''
+        try:
+            self.refresh()
+        except Exception as e:
+            print(e)
+        return self.ready
+
+    def start_refresher(self, interval=None, jitter=0.1, retry_interval=5):
+        '''
+        start_refresher(interval, jitter, retry_interval) method
+            @INPUTS
+                interval: seconds between refreshes, defaults to half the ttl
+                jitter: fraction by which each interval is randomly
+                    shortened or lengthened, so workers don't refresh
+                    in lockstep
+                retry_interval: seconds between attempts while no keys
+                    are loaded
+            it starts a daemon thread that loads the JWKS at once if
+                there are no keys yet, refreshes it before it goes stale,
+                and makes request threads non-blocking
+            return the refresher thread
+        '''
+        with self._lock:
+            if self._refresher is not None:
+                return self._refresher
+            if interval is None:
+                interval = self.ttl / 2
+            self._stop.clear()
+            self._refresher = threading.Thread(
+                target=self._refresh_forever,
+                args=(interval, jitter, retry_interval),
+                name='jwks-refresher',
+                daemon=True
+            )
+            self._refresher.start()
+            return self._refresher
+
+    def stop_refresher(self):
+        with self._lock:
+            refresher, self._refresher = self._refresher, None
+        if refresher is not None:
+            self._stop.set()
+            refresher.join()
+
+    def clear(self):
+        with self._lock:
+            self._jwks = None
+            self._keys = None
+            self._fetched_at = None
+
+    def _may_force_refresh(self):
+        fetched_at = self._fetched_at
+        return (fetched_at is None or
+                self.clock() - fetched_at >= self.min_refresh_interval)
+
+    def _refresh_forever(self, interval, jitter, retry_interval):
+        # Without keys, the first attempt is made at once.
+        delay = 0 if not self.ready else None
+        while True:
+            if delay is None:
+                delay = interval if self.ready else retry_interval
+                delay *= random.uniform(1 - jitter, 1 + jitter)
+            if self._stop.wait(delay):
+                return
+            delay = None
+            try:
+                # A copy another worker saved within the interval will do.
+                self.refresh(max_age=interval)
+            except Exception as e:
+                print(e)
+
+    def _load(self, max_age):
+        '''
+        _load(max_age) method
+            return the JWKS and its age in seconds, read from the cache file
+                if it holds a copy younger than max_age, fetched otherwise
+        '''
+        if self.cache_file is None:
+            return self.fetch(), 0
+
+        try:
+            self._check_cache_dir()
+        except OSError as e:
+            print(e)
+            return self.fetch(), 0
+
+        copy = self._read_cache_file(max_age)
+        if copy is not None:
+            return copy
+
+        try:
+            lock_file = self._open_lock_file()
+        except OSError as e:
+            print(e)
+            return self.fetch(), 0
+
+        with lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have refreshed it while we waited.
+                copy = self._read_cache_file(max_age)
+                if copy is not None:
+                    return copy
+
+                jwks = self.fetch()
+                self._write_cache_file(jwks)
+                return jwks, 0
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _check_cache_dir(self):
+        '''
+        _check_cache_dir() method
+            it creates the directory of the cache file, private to the
+                current user, if it does not exist
+            it raises an OSError if it is not a directory of the current
+                user that only they can write to
+        '''
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        st = os.lstat(directory)
+        if not stat.S_ISDIR(st.st_mode):
+            raise OSError(f'{directory} is not a directory.')
+        check_private(st, directory)
+
+    def _open_lock_file(self):
+        lock_path = self.cache_file + '.lock'
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT | O_NOFOLLOW, 0o600)
+        try:
+            check_private(os.fstat(fd), lock_path)
+        except OSError:
+            os.close(fd)
+            raise
+        return os.fdopen(fd, 'a')
+
+    def _read_cache_file(self, max_age):
+        try:
+            fd = os.open(self.cache_file, os.O_RDONLY | O_NOFOLLOW)
+        except OSError:
+            return None
+        with os.fdopen(fd) as f:
+            try:
+                st = os.fstat(fd)
+                check_private(st, self.cache_file)
+                age = max(time.time() - st.st_mtime, 0)
+                if age >= max_age:
+                    return None
+                return json.load(f), age
+            except OSError as e:
+                print(e)
+                return None
+            except ValueError:
+                return None
+
+    def _write_cache_file(self, jwks):
+        try:
+            # mkstemp creates the file readable and writable by its owner
+            # only, and os.replace swaps it in atomically.
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.cache_file)))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(jwks, f)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            print(e)
+
+    def _revalidate(self, max_age=None):
+        with self._lock:
+            if self._revalidating:
+                return
+            # Don't hammer an upstream that has just failed.
+            if (self._failed_at is not None and
+                    self.clock() - self._failed_at < self.min_refresh_interval):
+                return
+            self._revalidating = True
+
+        def run():
+            try:
+                self.refresh(max_age=max_age)
+                self._failed_at = None
+            except Exception as e:
+                print(e)
+                self._failed_at = self.clock()
+            finally:
+                self._revalidating = False
+
+        threading.Thread(target=run, daemon=True).start()
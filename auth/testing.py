@@ -0,0 +1,79 @@
+'''
+Helpers for minting tokens signed by a local key pair, so the auth code
+can be tested and benchmarked without Auth0 or network access.
+'''
+import base64
+import json
+import os
+import time
+
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+from config import auth0_config
+
+
+AUTH0_DOMAIN = auth0_config['AUTH0_DOMAIN']
+API_AUDIENCE = auth0_config['API_AUDIENCE']
+
+
+def b64_int(value):
+    raw = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def make_signing_key(kid, bits=2048):
+    '''
+    make_signing_key(kid) method
+        @INPUTS
+            kid: the key id to publish the key under
+        it generates a new RSA key pair
+        return the PEM private key and the public key as a JWK
+    '''
+    key = RSA.generate(bits)
+    jwk = {
+        'kty': 'RSA',
+        'kid': kid,
+        'use': 'sig',
+        'alg': 'RS256',
+        'n': b64_int(key.n),
+        'e': b64_int(key.e)
+    }
+    return key.exportKey('PEM').decode('ascii'), jwk
+
+
+def write_jwks(path, jwks):
+    '''
+    write_jwks(path, jwks) method
+        @INPUTS
+            path: the file to write
+            jwks: a list of JWKs
+        return a file:// URL that can be used as the JWKS_URL
+    '''
+    with open(path, 'w') as f:
+        json.dump({'keys': jwks}, f)
+    return f'file://{os.path.abspath(path)}'
+
+
+def mint_token(private_key, kid, permissions, expires_in=3600):
+    '''
+    mint_token(private_key, kid, permissions, expires_in) method
+        @INPUTS
+            private_key: a PEM private key from make_signing_key
+            kid: the key id to put in the token header
+            permissions: a list of permission strings
+            expires_in: seconds until the token expires, negative for
+                an already expired token
+        return an RS256 token with the claims Auth0 would issue
+    '''
+    now = int(time.time())
+    claims = {
+        'iss': f'https://{AUTH0_DOMAIN}/',
+        'sub': 'auth0|test',
+        'aud': API_AUDIENCE,
+        'iat': now,
+        'exp': now + expires_in,
+        'permissions': permissions
+    }
+    return jwt.encode(claims, private_key, algorithm='RS256',
+                      headers={'kid': kid})
@@ -0,0 +1,92 @@
+import bisect
+import threading
+import time
+
+
+# Upper bounds of the histogram buckets, in milliseconds.
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+
+
+class Histogram:
+    '''
+    Histogram
+    A fixed-bucket histogram of durations in milliseconds
+        the last bucket counts everything above the largest bound
+    '''
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, duration):
+        self.counts[bisect.bisect_left(self.buckets, duration)] += 1
+        self.count += 1
+        self.total += duration
+
+    def snapshot(self):
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        return {
+            'count': self.count,
+            'sum': round(self.total, 6),
+            'buckets': dict(zip(bounds, self.counts))
+        }
+
+
+class PhaseTimer:
+    '''
+    PhaseTimer
+    Times the consecutive phases of one request
+        every lap(phase) call records the time spent since the previous
+            lap (or since the timer was created) under the given phase
+    '''
+    def __init__(self):
+        self.phases = []
+        self._last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self._last) * 1000))
+        self._last = now
+
+    def server_timing(self, prefix='auth-'):
+        '''
+        server_timing(prefix) method
+            return the phases as a Server-Timing header value
+        '''
+        return ', '.join(f'{prefix}{phase};dur={duration:.3f}'
+                         for phase, duration in self.phases)
+
+
+class AuthTiming:
+    '''
+    AuthTiming
+    Aggregates the per-phase timings of requires_auth
+        start() returns None while timing is disabled, so the
+            instrumented code only pays for a None check
+        finished timers are folded into one histogram per phase
+    '''
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        return PhaseTimer() if self.enabled else None
+
+    def record(self, timer):
+        with self._lock:
+            for phase, duration in timer.phases:
+                histogram = self._histograms.get(phase)
+                if histogram is None:
+                    histogram = self._histograms[phase] = Histogram()
+                histogram.observe(duration)
+
+    def snapshot(self):
+        with self._lock:
+            return {phase: histogram.snapshot()
+                    for phase, histogram in self._histograms.items()}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
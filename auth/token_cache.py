@@ -0,0 +1,86 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenCache:
+    '''
+    TokenCache
+    A bounded LRU cache of verified token payloads
+        entries are keyed by the SHA-256 digest of the raw token, so
+            bearer tokens are never kept in memory as-is
+        an entry is valid until the token's `exp` claim
+        the least recently used entry is evicted once `maxsize` is reached
+        hit and miss counters are kept to help size the cache
+    '''
+    def __init__(self, maxsize=1024, clock=time.time):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).digest()
+
+    def get(self, token):
+        '''
+        get(token) method
+            @INPUTS
+                token: a json web token (string)
+            return the cached payload, or None on a miss or an expired entry
+        '''
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, payload = entry
+            if self.clock() >= expires_at:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, token, payload):
+        '''
+        put(token, payload) method
+            @INPUTS
+                token: a json web token (string)
+                payload: the verified payload of the token
+            it does nothing if the payload has no `exp` claim
+        '''
+        if self.maxsize <= 0 or 'exp' not in payload:
+            return
+
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (payload['exp'], payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize
+            }
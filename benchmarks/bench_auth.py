@@ -0,0 +1,139 @@
+'''
+Offline benchmarks for the auth code in auth/auth.py
+
+A locally generated RSA key pair and a file:// JWKS stand in for Auth0,
+so the benchmarks run without network access. Run them from the root
+directory with:
+
+    python -m benchmarks.bench_auth [--iterations N]
+'''
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from flask import Flask
+from werkzeug.exceptions import HTTPException
+
+from auth import auth
+from auth.auth import AuthError, check_permissions, get_token_auth_header, \
+    requires_auth, verify_decode_jwt
+from auth.jwks import JWKSCache
+from auth.testing import make_signing_key, mint_token, write_jwks
+from auth.token_cache import TokenCache
+
+
+PERMISSIONS = [
+    'get:actors', 'post:actors', 'patch:actors', 'delete:actors',
+    'get:movies', 'post:movies', 'patch:movies', 'delete:movies'
+]
+
+
+def measure(fn, iterations, setup=None):
+    '''
+    measure(fn, iterations, setup) method
+        it calls fn `iterations` times, calling setup (untimed) before each
+        auth failures are expected for some scenarios and are ignored
+        return the list of call durations in seconds
+    '''
+    samples = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        try:
+            fn()
+        except (AuthError, HTTPException):
+            pass
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f'{name:<48} {statistics.mean(samples) * 1e6:>10.1f} '
+          f'{statistics.median(samples) * 1e6:>10.1f} {p99 * 1e6:>10.1f}')
+
+
+def run(iterations):
+    tmpdir = tempfile.TemporaryDirectory()
+    private_key, jwk = make_signing_key('bench-key')
+    stranger_key, _ = make_signing_key('unknown-key')
+    jwks_url = write_jwks(os.path.join(tmpdir.name, 'jwks.json'), [jwk])
+
+    auth.jwks_cache = JWKSCache(jwks_url)
+    auth.token_cache = TokenCache()
+
+    tokens = {
+        'one permission': mint_token(private_key, 'bench-key',
+                                     ['get:actors']),
+        'all permissions': mint_token(private_key, 'bench-key',
+                                      PERMISSIONS),
+        'expired': mint_token(private_key, 'bench-key', PERMISSIONS,
+                              expires_in=-60),
+        'wrong kid': mint_token(stranger_key, 'unknown-key', PERMISSIONS)
+    }
+    token = tokens['all permissions']
+
+    def cold_caches():
+        auth.jwks_cache.clear()
+        auth.token_cache.clear()
+
+    app = Flask(__name__)
+    view = requires_auth('get:actors')(lambda payload: payload)
+
+    def call_view(token):
+        headers = {'Authorization': f'Bearer {token}'}
+        with app.test_request_context(headers=headers):
+            return view()
+
+    print(f'{"scenario (microseconds)":<48} {"mean":>10} {"median":>10} '
+          f'{"p99":>10}')
+
+    headers = {'Authorization': f'Bearer {token}'}
+    with app.test_request_context(headers=headers):
+        report('get_token_auth_header',
+               measure(get_token_auth_header, iterations))
+
+    report('verify_decode_jwt cold (JWKS + signature)',
+           measure(lambda: verify_decode_jwt(token), iterations,
+                   setup=cold_caches))
+    report('verify_decode_jwt cold token, warm keys',
+           measure(lambda: verify_decode_jwt(token), iterations,
+                   setup=auth.token_cache.clear))
+    report('verify_decode_jwt warm',
+           measure(lambda: verify_decode_jwt(token), iterations))
+    report('verify_decode_jwt expired',
+           measure(lambda: verify_decode_jwt(tokens['expired']), iterations))
+    report('verify_decode_jwt wrong kid',
+           measure(lambda: verify_decode_jwt(tokens['wrong kid']),
+                   iterations))
+
+    for name in ('one permission', 'all permissions'):
+        payload = verify_decode_jwt(tokens[name])
+        plain = dict(payload)
+        report(f'check_permissions {name}',
+               measure(lambda: check_permissions('get:actors', payload),
+                       iterations))
+        report(f'check_permissions {name} (plain dict)',
+               measure(lambda: check_permissions('get:actors', plain),
+                       iterations))
+
+    report('requires_auth cold',
+           measure(lambda: call_view(token), iterations, setup=cold_caches))
+    report('requires_auth warm',
+           measure(lambda: call_view(token), iterations))
+    report('requires_auth expired',
+           measure(lambda: call_view(tokens['expired']), iterations))
+    report('requires_auth wrong kid',
+           measure(lambda: call_view(tokens['wrong kid']), iterations))
+
+    tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--iterations', type=int, default=200)
+    run(parser.parse_args().iterations)
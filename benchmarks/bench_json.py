@@ -0,0 +1,82 @@
+'''
+Offline benchmark of the JSON encoders in serializer.py
+
+It serializes a GET /movies response of 10,000 movies with three actors
+each, built with Movie.format() from in-memory rows, so it runs without
+a database. Run it from the root directory with:
+
+    python -m benchmarks.bench_json [--rows N] [--iterations N]
+'''
+import argparse
+import statistics
+import time
+
+from flask import Flask
+
+from models import Actor, Movie
+from serializer import ENCODERS, orjson, setup_serializer, jsonify
+
+
+def make_movies(rows):
+    '''
+    make_movies(rows) method
+        return `rows` unsaved movies, each with a cast of three actors
+    '''
+    actors = [Actor(id=i, name=f'Actor {i}', age=20 + i % 60,
+                    gender='female' if i % 2 else 'male')
+              for i in range(300)]
+    return [Movie(id=i, title=f'Movie {i}', release_year=str(1950 + i % 70),
+                  genre=('Drama', 'Thriller', 'Comedy')[i % 3],
+                  actors=actors[i % 100 * 3:i % 100 * 3 + 3])
+            for i in range(rows)]
+
+
+def measure(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(name, samples, size):
+    print(f'{name:<32} {statistics.mean(samples) * 1e3:>10.2f} '
+          f'{statistics.median(samples) * 1e3:>10.2f} {size:>12}')
+
+
+def run(rows, iterations):
+    movies = make_movies(rows)
+    data = {
+        'success': True,
+        'movies': [movie.format() for movie in movies],
+        'next': None
+    }
+
+    print(f'{rows} movies (milliseconds)'.ljust(32) +
+          f' {"mean":>10} {"median":>10} {"bytes":>12}')
+    for name in ENCODERS:
+        if name == 'orjson' and orjson is None:
+            print(f'{name:<32} not installed')
+            continue
+
+        app = Flask(__name__)
+        setup_serializer(app, name)
+        with app.test_request_context():
+            size = len(jsonify(data).data)
+            report(f'{name} jsonify',
+                   measure(lambda: jsonify(data), iterations), size)
+            report(f'{name} format() + jsonify',
+                   measure(lambda: jsonify({
+                       'success': True,
+                       'movies': [movie.format() for movie in movies],
+                       'next': None
+                   }), iterations), size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+    run(args.rows, args.iterations)
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    '''
+    ResponseCache
+    A bounded LRU cache of serialized responses
+        every entry is stored together with the table versions it was
+            built from, and is only served while they are still current,
+            so any insert, update or delete (which bumps the versions, see
+            models.TableVersion) invalidates exactly the entries built from
+            the written tables, in every worker
+        an entry also expires `ttl` seconds after it was stored
+        the least recently used entries are evicted once there are more
+            than `maxsize` of them or their bodies take more than
+            `max_bytes`; a body larger than `max_bytes` is never stored
+        hit, miss, eviction, expiration and invalidation counters are
+            kept to help size the cache
+    '''
+    def __init__(self, maxsize=256, max_bytes=64 * 1024 * 1024, ttl=60,
+                 clock=time.monotonic):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, versions):
+        '''
+        get(key, versions) method
+            @INPUTS
+                key: a hashable key, e.g. the route and its query parameters
+                versions: the current versions of the tables the response
+                    is built from
+            it drops the entry if it has expired or the versions changed
+            return the cached (body, mimetype) pair, or None on a miss
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            entry_versions, expires_at, body, mimetype = entry
+            if entry_versions != versions:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            if self.clock() >= expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body, mimetype
+
+    def put(self, key, versions, body, mimetype, ttl=None):
+        '''
+        put(key, versions, body, mimetype, ttl) method
+            @INPUTS
+                key: a hashable key, see get()
+                versions: the table versions the response was built from
+                body: the serialized response body (bytes)
+                mimetype: the mimetype of the response
+                ttl: seconds until the entry expires, defaults to the
+                    cache's ttl; math.inf keeps it until the next write
+            it evicts least recently used entries to stay within bounds
+        '''
+        if self.maxsize <= 0 or len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+            self._entries[key] = (versions, expires_at, body, mimetype)
+            self.size_bytes += len(body)
+            while (len(self._entries) > self.maxsize or
+                    self.size_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+            self._reset_counters()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'size_bytes': self.size_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.size_bytes -= len(entry[2])
@@ -7,10 +7,49 @@ DATABASE_URL = os.environ.get('DATABASE_URL') or 'postgresql:///agency'
 TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL') or 'postgresql:///agency_test'
 PROD_DATABASE_URL = os.environ.get('PROD_DATABASE_URL') or 'postgresql:///agency_prod'
 
+# Keyset pagination of the list endpoints
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE') or 100)
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE') or 1000)
+
+# Maximum number of rows in one POST /actors/bulk or POST /movies/bulk
+MAX_BULK_SIZE = int(os.environ.get('MAX_BULK_SIZE') or 1000)
+
+# Rows written per transaction by the `flask import` command
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE') or 100000)
+
+# Rows fetched per round trip by the streaming (?stream=true) list mode
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE') or 500)
+
+# Cache of serialized list responses, invalidated by writes
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE') or 256)
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES') or 64 * 1024 * 1024)
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL') or 60)
+
+# Whether GET /metrics/auth and GET /metrics/cache are served; they are
+# public, so they are off unless turned on for a private deployment
+METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or 'false').lower() == 'true'
+
+# Encoder of all JSON responses: 'json' (the standard library), 'orjson'
+# or 'auto', which uses orjson if it is installed
+JSON_ENCODER = os.environ.get('JSON_ENCODER') or 'auto'
+
+AUTH0_DOMAIN = 'fsnd-casting-agency.eu.auth0.com'
+
 auth0_config = {
-    'AUTH0_DOMAIN': 'fsnd-casting-agency.eu.auth0.com',
+    'AUTH0_DOMAIN': AUTH0_DOMAIN,
     'ALGORITHMS': ['RS256'],
-    'API_AUDIENCE': 'agency'
+    'API_AUDIENCE': 'agency',
+    # Any URL urlopen() understands, so a file:// JWKS or a local stub
+    # server can stand in for Auth0 in tests and benchmarks.
+    'JWKS_URL': os.environ.get('JWKS_URL') or f'https://{AUTH0_DOMAIN}/.well-known/jwks.json',
+    'JWKS_CACHE_TTL': int(os.environ.get('JWKS_CACHE_TTL') or 600),
+    # Optional JWKS copy shared on disk by all workers on the host.
+    'JWKS_CACHE_FILE': os.environ.get('JWKS_CACHE_FILE'),
+    # Load the JWKS at startup and keep it fresh from a background thread.
+    'JWKS_PREFETCH': (os.environ.get('JWKS_PREFETCH') or 'true').lower() == 'true',
+    'TOKEN_CACHE_SIZE': int(os.environ.get('TOKEN_CACHE_SIZE') or 1024),
+    # Per-phase timing of requires_auth (Server-Timing header + histograms).
+    'AUTH_TIMING': (os.environ.get('AUTH_TIMING') or 'false').lower() == 'true'
 }
 
 bearer_tokens = {
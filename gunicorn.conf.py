@@ -0,0 +1,13 @@
+'''
+gunicorn settings, read by the web process of the Procfile
+'''
+from auth.auth import setup_auth
+
+
+def post_worker_init(worker):
+    '''
+    post_worker_init(worker) hook
+        it starts the JWKS refresher of each worker once it is forked,
+            before it accepts requests, so no request waits for Auth0
+    '''
+    setup_auth(worker.wsgi)
@@ -0,0 +1,311 @@
+import csv
+import io
+import itertools
+import json
+import os
+
+import click
+
+import config
+from models import db, Actor, Movie, Role, TableVersion
+
+# The tables `flask import` loads, by the name it accepts
+MODELS = {
+    'actors': Actor,
+    'movies': Movie,
+    'roles': Role
+}
+FORMATS = ('csv', 'ndjson')
+
+
+class ImportFileError(click.ClickException):
+    '''
+    ImportFileError
+    An error in the imported file, reported with its line number
+    '''
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+
+
+def read_csv(file):
+    '''
+    read_csv(file) method
+        @INPUTS
+            file: a CSV file whose header names the columns
+        return the columns and an iterator of (line, values) pairs
+    '''
+    reader = csv.reader(file)
+    columns = next(reader, [])
+
+    def rows():
+        for values in reader:
+            if len(values) != len(columns):
+                raise ImportFileError(reader.line_num,
+                                      f'expected {len(columns)} values.')
+            yield reader.line_num, values
+    return columns, rows()
+
+
+def read_ndjson(file):
+    '''
+    read_ndjson(file) method
+        @INPUTS
+            file: a file of one JSON object per line, all with the keys
+                of the first one
+        return the columns and an iterator of (line, values) pairs
+    '''
+    def objects():
+        for line, text in enumerate(file, 1):
+            if not text.strip():
+                continue
+            try:
+                item = json.loads(text)
+            except ValueError as e:
+                raise ImportFileError(line, f'invalid JSON: {e}.')
+            if not isinstance(item, dict):
+                raise ImportFileError(line, 'expected an object.')
+            yield line, item
+
+    items = objects()
+    first = next(items, None)
+    if first is None:
+        return [], iter(())
+    columns = list(first[1])
+
+    def rows():
+        for line, item in itertools.chain([first], items):
+            if item.keys() != first[1].keys():
+                raise ImportFileError(line, f'expected the keys {columns}.')
+            values = [item[column] for column in columns]
+            if any(isinstance(value, (dict, list)) for value in values):
+                raise ImportFileError(line, 'values must be scalars.')
+            yield line, values
+    return columns, rows()
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson
+}
+
+
+class CopyStream:
+    '''
+    CopyStream
+    A file-like object that feeds up to `limit` rows to COPY FROM STDIN
+        it formats the rows as CSV, prefixed with their line number, only
+            as COPY reads them, so memory use does not depend on the size
+            of the imported file
+        None and empty values are sent as NULL
+        an error in the file ends the stream, and is kept in `error`
+            rather than raised through COPY
+    '''
+    def __init__(self, rows, limit):
+        self.rows = rows
+        self.limit = limit
+        self.count = 0
+        self.error = None
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+
+    def read(self, size=8192):
+        while self._buffer.tell() < size and self.count < self.limit:
+            try:
+                row = next(self.rows, None)
+            except click.ClickException as e:
+                self.error = e
+                row = None
+            if row is None:
+                break
+            line, values = row
+            self._writer.writerow([line] + values)
+            self.count += 1
+
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
+def upsert_statement(table, columns, on_conflict):
+    '''
+    upsert_statement(table, columns, on_conflict) method
+        @INPUTS
+            table: the name of the table
+            columns: the imported columns
+            on_conflict: 'update' or 'skip' rows whose ID already exists
+        return the statement that writes the staged rows to the table and
+            returns the number of inserted and updated rows
+    '''
+    column_list = ', '.join(columns)
+    if table == 'roles':
+        # Roles of missing actors or movies are skipped, and so are
+        # existing roles, which have nothing to update. The columns are
+        # listed in the order of the SELECT, not of the file.
+        column_list = 'movie_id, actor_id'
+        select = '''
+            SELECT DISTINCT s.movie_id, s.actor_id
+            FROM import_roles s
+            JOIN movies ON movies.id = s.movie_id
+            JOIN actors ON actors.id = s.actor_id'''
+        conflict = 'ON CONFLICT DO NOTHING'
+    elif 'id' in columns:
+        # The last of the rows with the same ID wins.
+        select = f'''
+            SELECT DISTINCT ON (id) {column_list}
+            FROM import_{table}
+            ORDER BY id, line DESC'''
+        if on_conflict == 'update' and len(columns) > 1:
+            conflict = 'ON CONFLICT (id) DO UPDATE SET ' + ', '.join(
+                f'{column} = EXCLUDED.{column}'
+                for column in columns if column != 'id')
+        else:
+            conflict = 'ON CONFLICT (id) DO NOTHING'
+    else:
+        select = f'SELECT {column_list} FROM import_{table} ORDER BY line'
+        conflict = ''
+
+    # xmax is 0 for a new row, and set for an updated one.
+    return f'''
+        WITH written AS (
+            INSERT INTO {table} ({column_list})
+            {select}
+            {conflict}
+            RETURNING xmax = 0 AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER
+            (WHERE NOT inserted)
+        FROM written'''
+
+
+def import_rows(table, columns, rows, on_conflict, batch_size):
+    '''
+    import_rows(table, columns, rows, on_conflict, batch_size) method
+        @INPUTS
+            table: the name of the table
+            columns: the imported columns, all columns of the table
+            rows: an iterator of (line, values) pairs
+            on_conflict: see upsert_statement
+            batch_size: the number of rows written per transaction
+        for each batch, it copies the rows into a temporary staging table
+            with COPY FROM STDIN, writes them to the table with a single
+            INSERT ... SELECT ... ON CONFLICT, moves the ID sequence past
+            the imported IDs, bumps the table version and commits
+        it reports the progress after each batch; an error rolls back
+            the current batch only
+        return the number of read, inserted, updated and skipped rows
+    '''
+    column_list = ', '.join(columns)
+    statement = upsert_statement(table, columns, on_conflict)
+    totals = {'read': 0, 'inserted': 0, 'updated': 0, 'skipped': 0}
+
+    while True:
+        # The staging table is dropped at the end of each transaction, as
+        # the session may use another connection for the next one.
+        cursor = db.session.connection().connection.cursor()
+        cursor.execute(f'''
+            CREATE TEMPORARY TABLE import_{table} ON COMMIT DROP AS
+            SELECT 0::bigint AS line, {column_list} FROM {table}
+            WITH NO DATA''')
+        stream = CopyStream(rows, batch_size)
+        cursor.copy_expert(
+            f'COPY import_{table} (line, {column_list}) FROM STDIN '
+            f'WITH (FORMAT csv)', stream)
+        if stream.error is not None:
+            raise stream.error
+        if not stream.count:
+            db.session.rollback()
+            break
+
+        cursor.execute(statement)
+        inserted, updated = cursor.fetchone()
+        if 'id' in columns:
+            # New rows without an id must not reuse the imported IDs.
+            cursor.execute(f'''
+                SELECT setval(pg_get_serial_sequence('{table}', 'id'),
+                              COALESCE(max(id), 0) + 1, false)
+                FROM {table}''')
+        if inserted or updated:
+            TableVersion.bump(table)
+        db.session.commit()
+
+        totals['read'] += stream.count
+        totals['inserted'] += inserted
+        totals['updated'] += updated
+        totals['skipped'] += stream.count - inserted - updated
+        click.echo(f'{table}: {totals["read"]} rows read, '
+                   f'{totals["inserted"]} inserted, '
+                   f'{totals["updated"]} updated, '
+                   f'{totals["skipped"]} skipped', err=True)
+    return totals
+
+
+def get_format(path, file_format):
+    if file_format is not None:
+        return file_format
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    raise click.UsageError(f'Cannot tell the format of {path}, '
+                           f'use --format.')
+
+
+@click.command('import')
+@click.argument('table', type=click.Choice(list(MODELS)))
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'file_format', type=click.Choice(FORMATS),
+              help='The format of FILE, by default guessed from its '
+                   'extension: .csv, .ndjson or .jsonl.')
+@click.option('--on-conflict', type=click.Choice(['update', 'skip']),
+              default='update', show_default=True,
+              help='Update or skip rows whose id already exists.')
+@click.option('--batch-size', type=click.IntRange(min=1),
+              default=config.IMPORT_BATCH_SIZE, show_default=True,
+              help='Rows written per transaction.')
+def import_command(table, file, file_format, on_conflict, batch_size):
+    '''
+    Import actors, movies or roles from a CSV or NDJSON file.
+
+    The columns are those of the CSV header, or the keys of the JSON
+    objects. Without an id column, every row is a new actor or movie.
+    Roles need movie_id and actor_id, and those of missing movies or
+    actors are skipped. Use - as FILE to read the standard input.
+
+    Each batch is committed on its own, so an error stops the import
+    after the batches already reported.
+    '''
+    reader = READERS[get_format(file.name, file_format)]
+    columns, rows = reader(file)
+
+    allowed = MODELS[table].__table__.columns.keys()
+    unknown = [column for column in columns if column not in allowed]
+    if not columns or unknown or len(set(columns)) != len(columns):
+        raise click.ClickException(
+            f'The columns must be distinct columns of {table}: '
+            f'{", ".join(allowed)}.')
+    if table == 'roles' and set(columns) != {'movie_id', 'actor_id'}:
+        raise click.ClickException('Roles need movie_id and actor_id.')
+
+    try:
+        totals = import_rows(table, columns, rows, on_conflict, batch_size)
+    except click.ClickException:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(str(e).strip())
+
+    click.echo(f'Imported {totals["inserted"] + totals["updated"]} of '
+               f'{totals["read"]} rows into {table}.')
+
+
+def setup_importer(app):
+    '''
+    setup_importer(app) method
+        @INPUTS
+            app: the Flask application
+        it registers the `flask import` command
+    '''
+    app.cli.add_command(import_command)
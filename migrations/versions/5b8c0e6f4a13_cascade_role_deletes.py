@@ -0,0 +1,38 @@
+"""cascade role deletes
+
+Revision ID: 5b8c0e6f4a13
+Revises: 7d2e4a91c0b8
+Create Date: 2026-10-17 14:26:09.835102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8c0e6f4a13'
+down_revision = '7d2e4a91c0b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_constraint('roles_actor_id_fkey', 'roles', type_='foreignkey')
+    op.drop_constraint('roles_movie_id_fkey', 'roles', type_='foreignkey')
+    op.create_foreign_key('roles_actor_id_fkey', 'roles', 'actors',
+                          ['actor_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('roles_movie_id_fkey', 'roles', 'movies',
+                          ['movie_id'], ['id'], ondelete='CASCADE')
+    # The cascade looks roles up by movie_id, which the (actor_id,
+    # movie_id) primary key cannot serve.
+    op.create_index('ix_roles_movie_id', 'roles', ['movie_id'])
+
+
+def downgrade():
+    op.drop_index('ix_roles_movie_id', table_name='roles')
+    op.drop_constraint('roles_movie_id_fkey', 'roles', type_='foreignkey')
+    op.drop_constraint('roles_actor_id_fkey', 'roles', type_='foreignkey')
+    op.create_foreign_key('roles_actor_id_fkey', 'roles', 'actors',
+                          ['actor_id'], ['id'])
+    op.create_foreign_key('roles_movie_id_fkey', 'roles', 'movies',
+                          ['movie_id'], ['id'])
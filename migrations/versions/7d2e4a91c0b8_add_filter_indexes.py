@@ -0,0 +1,36 @@
+"""add filter indexes
+
+Revision ID: 7d2e4a91c0b8
+Revises: 3c1f9d2b7e54
+Create Date: 2026-10-17 11:02:47.218934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2e4a91c0b8'
+down_revision = '3c1f9d2b7e54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_actors_gender_id', 'actors', ['gender', 'id'])
+    op.create_index('ix_actors_age', 'actors', ['age'])
+    op.create_index('ix_actors_name_prefix', 'actors',
+                    [sa.text('(lower(name) COLLATE "C")')])
+    op.create_index('ix_movies_genre_id', 'movies', ['genre', 'id'])
+    op.create_index('ix_movies_release_year', 'movies', ['release_year'])
+    op.create_index('ix_movies_title_prefix', 'movies',
+                    [sa.text('(lower(title) COLLATE "C")')])
+
+
+def downgrade():
+    op.drop_index('ix_movies_title_prefix', table_name='movies')
+    op.drop_index('ix_movies_release_year', table_name='movies')
+    op.drop_index('ix_movies_genre_id', table_name='movies')
+    op.drop_index('ix_actors_name_prefix', table_name='actors')
+    op.drop_index('ix_actors_age', table_name='actors')
+    op.drop_index('ix_actors_gender_id', table_name='actors')
@@ -1,5 +1,7 @@
 from os import getenv
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import collate
+from sqlalchemy.dialects.postgresql import insert
 import config
 
 db = SQLAlchemy()
@@ -12,24 +14,158 @@ def setup_db(app, db_name=None):
     db.init_app(app)
 
 
-class Actor(db.Model):
+class TableVersion(db.Model):
+    '''
+    TableVersion
+    A counter per table, bumped by every write to that table in the same
+    transaction, so all workers agree on whether the data has changed
+    '''
+    __tablename__ = 'table_versions'
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, *names):
+        # Rows are always locked in the same order to avoid deadlocks.
+        statement = insert(cls.__table__).values(
+            [{'name': name, 'version': 1} for name in sorted(set(names))])
+        statement = statement.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'version': cls.__table__.c.version + 1}
+        )
+        db.session.execute(statement)
+
+    @classmethod
+    def get_versions(cls, *names):
+        versions = dict(db.session.query(cls.name, cls.version)
+                        .filter(cls.name.in_(names)).all())
+        return tuple(versions.get(name, 0) for name in names)
+
+
+class BulkWriteMixin:
+    '''
+    BulkWriteMixin
+    Single-statement writes by ID shared by Actor and Movie, which bump
+        the version of the model's own table
+    '''
+    @classmethod
+    def insert_many(cls, rows, commit=True, bump=True):
+        '''
+        insert_many(rows, commit, bump) method
+            @INPUTS
+                rows: a list of dictionaries of column values
+                commit: False to leave the transaction open
+                bump: False to leave bumping the table version to the
+                    caller
+            it inserts all the rows with a single multi-row INSERT and,
+                unless commit is False, commits once
+            return the IDs of the new rows, in the order of the rows
+        '''
+        result = db.session.execute(
+            insert(cls.__table__).values(rows).returning(cls.id))
+        ids = [row_id for row_id, in result]
+        if bump:
+            TableVersion.bump(cls.__tablename__)
+        if commit:
+            db.session.commit()
+        return ids
+
+    @classmethod
+    def update_fields(cls, row_id, values, commit=True, bump=True):
+        '''
+        update_fields(row_id, values, commit, bump) method
+            @INPUTS
+                row_id: the ID of the row
+                values: a dictionary of the column values to write
+                commit: False to leave the transaction open
+                bump: False to leave bumping the table version to the
+                    caller
+            it updates the row with a single UPDATE ... RETURNING, without
+                loading it first, and commits unless commit is False
+            return the updated row, or None if there is no such row
+        '''
+        statement = cls.__table__.update()\
+            .where(cls.id == row_id)\
+            .values(values)\
+            .returning(*cls.__table__.columns)
+        row = db.session.execute(statement).first()
+        if row is not None and bump:
+            TableVersion.bump(cls.__tablename__)
+        if commit:
+            db.session.commit()
+        return row
+
+    @classmethod
+    def delete_by_id(cls, row_id, commit=True, bump=True):
+        '''
+        delete_by_id(row_id, commit, bump) method
+            @INPUTS
+                row_id: the ID of the row
+                commit: False to leave the transaction open
+                bump: False to leave bumping the table versions to the
+                    caller
+            it deletes the row with a single DELETE ... RETURNING id,
+                without loading it or its roles, which the database
+                deletes with it (ON DELETE CASCADE), and commits unless
+                commit is False
+            return True if there was such a row
+        '''
+        statement = cls.__table__.delete()\
+            .where(cls.id == row_id)\
+            .returning(cls.id)
+        deleted = db.session.execute(statement).first() is not None
+        if deleted and bump:
+            TableVersion.bump(cls.__tablename__, 'roles')
+        if commit:
+            db.session.commit()
+        return deleted
+
+
+class Actor(BulkWriteMixin, db.Model):
     __tablename__ = 'actors'
 
+    # Columns that can be requested with ?fields=, and those format_self()
+    # embeds in a related movie
+    FIELDS = ('id', 'name', 'age', 'gender')
+    SELF_FIELDS = ('name', 'age', 'gender')
+    # Query parameters of GET /actors that filter on a column:
+    # parameter -> (column, 'eq' | 'min' | 'max' | 'prefix')
+    FILTERS = {
+        'gender': ('gender', 'eq'),
+        'age_min': ('age', 'min'),
+        'age_max': ('age', 'max'),
+        'name': ('name', 'prefix')
+    }
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     age = db.Column(db.Integer)
     gender = db.Column(db.String(10))
-    movies = db.relationship('Movie', secondary='roles')
+    movies = db.relationship('Movie', secondary='roles',
+                             passive_deletes=True)
+
+    # The indexes behind FILTERS; (gender, id) also serves the id order
+    # of keyset pagination, and the name prefix index compares bytes
+    # (COLLATE "C") so that LIKE 'prefix%' can use it
+    __table_args__ = (
+        db.Index('ix_actors_gender_id', gender, id),
+        db.Index('ix_actors_age', age),
+        db.Index('ix_actors_name_prefix', collate(db.func.lower(name), 'C'))
+    )
 
     def insert(self):
         db.session.add(self)
+        TableVersion.bump('actors')
         db.session.commit()
 
     def update(self):
+        TableVersion.bump('actors')
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        TableVersion.bump('actors', 'roles')
         db.session.commit()
 
     def format(self):
@@ -52,24 +188,48 @@ class Actor(db.Model):
         return f'<Actor {self.id} - {self.name}>'
 
 
-class Movie(db.Model):
+class Movie(BulkWriteMixin, db.Model):
     __tablename__ = 'movies'
 
+    # Columns that can be requested with ?fields=, and those format_self()
+    # embeds in a related actor
+    FIELDS = ('id', 'title', 'release_year', 'genre')
+    SELF_FIELDS = ('title', 'release_year', 'genre')
+    # Query parameters of GET /movies that filter on a column, see Actor
+    FILTERS = {
+        'genre': ('genre', 'eq'),
+        'release_year_min': ('release_year', 'min'),
+        'release_year_max': ('release_year', 'max'),
+        'title': ('title', 'prefix')
+    }
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(120), nullable=False)
     release_year = db.Column(db.String(4))
     genre = db.Column(db.String(50))
-    actors = db.relationship('Actor', secondary='roles')
+    actors = db.relationship('Actor', secondary='roles',
+                             passive_deletes=True)
+
+    # The indexes behind FILTERS, see Actor
+    __table_args__ = (
+        db.Index('ix_movies_genre_id', genre, id),
+        db.Index('ix_movies_release_year', release_year),
+        db.Index('ix_movies_title_prefix',
+                 collate(db.func.lower(title), 'C'))
+    )
 
     def insert(self):
         db.session.add(self)
+        TableVersion.bump('movies')
         db.session.commit()
 
     def update(self):
+        TableVersion.bump('movies')
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        TableVersion.bump('movies', 'roles')
         db.session.commit()
 
     def format(self):
@@ -95,24 +255,82 @@ class Movie(db.Model):
 class Role(db.Model):
     __tablename__ = 'roles'
 
+    # Deleting an actor or a movie deletes its roles in the database
     actor_id = db.Column(
         db.Integer,
-        db.ForeignKey('actors.id'),
+        db.ForeignKey('actors.id', ondelete='CASCADE'),
         primary_key=True
     )
     movie_id = db.Column(
         db.Integer,
-        db.ForeignKey('movies.id'),
+        db.ForeignKey('movies.id', ondelete='CASCADE'),
         primary_key=True
     )
 
+    # The cascade from movies looks roles up by movie_id
+    __table_args__ = (
+        db.Index('ix_roles_movie_id', movie_id),
+    )
+
     def insert(self):
         db.session.add(self)
+        TableVersion.bump('roles')
+        db.session.commit()
+
+    @classmethod
+    def insert_many(cls, movie_id, actor_ids, commit=True, bump=True):
+        '''
+        insert_many(movie_id, actor_ids, commit, bump) method
+            @INPUTS
+                movie_id: the ID of the movie
+                actor_ids: the IDs of the actors to cast in it
+                commit: False to leave the transaction open
+                bump: False to leave bumping the table version to the
+                    caller
+            it inserts all the roles with a single multi-row INSERT,
+                skipping those that already exist (ON CONFLICT DO NOTHING),
+                and, unless commit is False, commits once
+            it raises an IntegrityError if the movie or an actor does not
+                exist
+            return the IDs of the actors whose role was inserted
+        '''
+        statement = insert(cls.__table__)\
+            .values([{'movie_id': movie_id, 'actor_id': actor_id}
+                     for actor_id in actor_ids])\
+            .on_conflict_do_nothing()\
+            .returning(cls.actor_id)
+        inserted = [actor_id for actor_id, in db.session.execute(statement)]
+        if inserted and bump:
+            TableVersion.bump('roles')
+        if commit:
+            db.session.commit()
+        return inserted
+
+    @classmethod
+    def delete_one(cls, movie_id, actor_id):
+        '''
+        delete_one(movie_id, actor_id) method
+            @INPUTS
+                movie_id: the ID of the movie
+                actor_id: the ID of the actor
+            it deletes the role with a single DELETE ... RETURNING,
+                without loading it first, and commits
+            return True if there was such a role
+        '''
+        statement = cls.__table__.delete()\
+            .where((cls.movie_id == movie_id) & (cls.actor_id == actor_id))\
+            .returning(cls.actor_id)
+        deleted = db.session.execute(statement).first() is not None
+        if deleted:
+            TableVersion.bump('roles')
         db.session.commit()
+        return deleted
 
     def update(self):
+        TableVersion.bump('roles')
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        TableVersion.bump('roles')
         db.session.commit()
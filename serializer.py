@@ -0,0 +1,100 @@
+from flask import current_app, json
+from flask import jsonify as flask_jsonify
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional dependency
+    orjson = None
+
+
+def stdlib_dumps(obj):
+    '''
+    stdlib_dumps(obj) method
+        return obj serialized by Flask's own json module, as bytes
+    '''
+    return json.dumps(obj).encode('utf-8')
+
+
+def orjson_dumps(obj):
+    '''
+    orjson_dumps(obj) method
+        it serializes obj with orjson, sorting the keys like Flask does
+            unless JSON_SORT_KEYS is turned off
+        it falls back on the app's JSONEncoder for types orjson does
+            not know, e.g. UUID
+        return the serialized bytes
+    '''
+    option = orjson.OPT_SORT_KEYS \
+        if current_app.config['JSON_SORT_KEYS'] else 0
+    return orjson.dumps(obj, default=current_app.json_encoder().default,
+                        option=option)
+
+
+# The available encoders, by the name JSON_ENCODER / create_app accept.
+ENCODERS = {
+    'json': stdlib_dumps,
+    'orjson': orjson_dumps
+}
+
+
+def get_encoder(name='auto'):
+    '''
+    get_encoder(name) method
+        @INPUTS
+            name: 'json', 'orjson' or 'auto', which picks orjson if it is
+                installed and json otherwise
+        it raises a ValueError for an unknown or unavailable encoder
+        return the name and the dumps function of the encoder
+    '''
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+
+    if name not in ENCODERS:
+        raise ValueError(f'Unknown JSON encoder: {name}.')
+    if name == 'orjson' and orjson is None:
+        raise ValueError('The orjson encoder requires the orjson package.')
+
+    return name, ENCODERS[name]
+
+
+def setup_serializer(app, name='auto'):
+    '''
+    setup_serializer(app, name) method
+        @INPUTS
+            app: the Flask application
+            name: the encoder to use for all JSON responses, see get_encoder
+        it records the encoder in app.extensions, where jsonify finds it
+    '''
+    app.extensions['serializer'] = get_encoder(name)
+
+
+def dumps(obj):
+    '''
+    dumps(obj) method
+        return obj serialized by the current app's encoder, as a string
+    '''
+    _, encoder = current_app.extensions.get('serializer', get_encoder('json'))
+    return encoder(obj).decode('utf-8')
+
+
+def jsonify(*args, **kwargs):
+    '''
+    jsonify(*args, **kwargs) method
+        a drop-in replacement for flask.jsonify that uses the current
+            app's encoder
+        with the json encoder it is flask.jsonify itself, so responses
+            are byte-for-byte the same as before
+        return a JSON response
+    '''
+    name, encoder = current_app.extensions.get('serializer', ('json', None))
+    if name == 'json':
+        return flask_jsonify(*args, **kwargs)
+
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both '
+                        'args and kwargs')
+    data = args[0] if len(args) == 1 else args or kwargs
+    return current_app.response_class(
+        encoder(data) + b'\n',
+        mimetype=current_app.config['JSONIFY_MIMETYPE']
+    )
@@ -1,35 +1,167 @@
 import json
+import os
+import tempfile
 import unittest
 import HtmlTestRunner
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from werkzeug.exceptions import NotFound
 
 import config
-from app import APP
-from models import db
+from app import APP, response_cache, describe_missing, get_formatted
+from auth import auth
+from auth.jwks import JWKSCache
+from auth.testing import make_signing_key, mint_token, write_jwks
+from auth.token_cache import TokenCache
+from models import db, Movie, TableVersion
+
+
+# The tokens of each role are signed by a local key pair, published in a
+# local JWKS, so the tests need neither Auth0 nor unexpired real tokens.
+ASSISTANT_PERMISSIONS = ['get:actors', 'get:movies']
+DIRECTOR_PERMISSIONS = ASSISTANT_PERMISSIONS + [
+    'post:actors', 'patch:actors', 'delete:actors', 'patch:movies']
+PRODUCER_PERMISSIONS = DIRECTOR_PERMISSIONS + ['post:movies', 'delete:movies']
+
+private_key, jwk = make_signing_key('test-key')
+casting_assistant_token = mint_token(private_key, 'test-key',
+                                     ASSISTANT_PERMISSIONS)
+casting_director_token = mint_token(private_key, 'test-key',
+                                    DIRECTOR_PERMISSIONS)
+executive_producer_token = mint_token(private_key, 'test-key',
+                                      PRODUCER_PERMISSIONS)
 
 
-casting_assistant_token = config.bearer_tokens['casting_assistant']
-casting_director_token = config.bearer_tokens['casting_director']
-executive_producer_token = config.bearer_tokens['executive_producer']
+class CastingAgencyTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.jwks_url = write_jwks(
+            os.path.join(cls.tmpdir.name, 'jwks.json'), [jwk])
 
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
 
-class CastingAgencyTestCase(unittest.TestCase):
     def setUp(self):
         APP.config['SQLALCHEMY_DATABASE_URI'] = config.TEST_DATABASE_URL
+        # Tokens are verified against keys fetched on demand, without
+        # the background refresher
+        APP.config['JWKS_PREFETCH'] = False
+        APP.config['METRICS_ENABLED'] = False
         self.app = APP
         self.client = self.app.test_client
         self.headers = {'Content-Type': 'application/json'}
+        self.originals = (auth.jwks_cache, auth.token_cache)
+        auth.jwks_cache = JWKSCache(self.jwks_url)
+        auth.token_cache = TokenCache()
         db.drop_all()
         db.create_all()
+        response_cache.clear()
 
     def tearDown(self):
-        pass
+        auth.jwks_cache, auth.token_cache = self.originals
+        db.session.remove()
+
+    def count_queries(self, request):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            request()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return len(statements)
+
+    def add_movie_with_cast(self, cast_size):
+        response = self.client().post(
+            '/movies',
+            headers=self.headers,
+            data=json.dumps({
+                'title': 'The Devil All the Time',
+                'release_year': '2020',
+                'genre': 'Drama'
+            })
+        )
+        movie_id = json.loads(response.data)['movie']['id']
+
+        for _ in range(cast_size):
+            response = self.client().post(
+                '/actors',
+                headers=self.headers,
+                data=json.dumps({
+                    'name': 'Jason Bourne',
+                    'age': 35,
+                    'gender': 'male'
+                })
+            )
+            self.client().post(
+                f'/movies/{movie_id}/actors',
+                headers=self.headers,
+                data=json.dumps({
+                    'actor_id': json.loads(response.data)['actor']['id']
+                })
+            )
+        return movie_id
 
     def test_home_page(self):
         response = self.client().get('/')
         self.assertEqual(response.status_code, 200)
         self.assertTrue('Casting Agency' in response.get_data(as_text=True))
 
+    def test_ready(self):
+        response = self.client().get('/ready')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(json.loads(response.data)['ready'])
+
+        auth.jwks_cache.prefetch()
+        response = self.client().get('/ready')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(data['ready'])
+
+    def test_auth_metrics(self):
+        APP.config['METRICS_ENABLED'] = True
+        response = self.client().get('/metrics/auth')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertIn('hits', data['token_cache'])
+        self.assertIsInstance(data['timing'], dict)
+
+    def test_auth_metrics_disabled(self):
+        response = self.client().get('/metrics/auth')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(data['success'])
+        self.assertNotIn('token_cache', data)
+
+    def test_cache_metrics(self):
+        APP.config['METRICS_ENABLED'] = True
+        response = self.client().get('/metrics/cache')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertIn('hit_ratio', data['response_cache'])
+        self.assertIn('evictions', data['response_cache'])
+
+    def test_cache_metrics_disabled(self):
+        response = self.client().get('/metrics/cache')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(data['success'])
+        self.assertNotIn('response_cache', data)
+
     def test_get_actors(self):
         self.headers.update(
             {'Authorization': f'Bearer {casting_assistant_token}'}
@@ -50,6 +182,117 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 401)
         self.assertFalse(data['success'])
 
+    def test_get_actors_paginated(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {casting_director_token}'}
+        )
+        actor_ids = []
+        for name in ['Jason Bourne', 'Ann Smith', 'Tim Robbins']:
+            response = self.client().post(
+                '/actors',
+                headers=self.headers,
+                data=json.dumps({
+                    'name': name,
+                    'age': 35,
+                    'gender': 'male'
+                })
+            )
+            actor_ids.append(json.loads(response.data)['actor']['id'])
+
+        response = self.client().get(
+            '/actors?limit=2',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual([a['id'] for a in data['actors']], actor_ids[:2])
+        self.assertEqual(data['next'], actor_ids[1])
+
+        response = self.client().get(
+            f"/actors?limit=2&after_id={data['next']}",
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([a['id'] for a in data['actors']], actor_ids[2:])
+        self.assertIsNone(data['next'])
+
+    def test_get_actors_invalid_page(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {casting_assistant_token}'}
+        )
+        response = self.client().get(
+            '/actors?limit=abc',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_get_actors_include_movies(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        self.add_movie_with_cast(1)
+
+        response = self.client().get(
+            '/actors?include=movies',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['actors'][0]['name'], 'Jason Bourne')
+        self.assertEqual(data['actors'][0]['movies'], [{
+            'title': 'The Devil All the Time',
+            'release_year': '2020',
+            'genre': 'Drama'
+        }])
+
+    def test_get_actors_filtered(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {casting_director_token}'}
+        )
+        for name, age, gender in [('Brad Pitt', 56, 'male'),
+                                  ('Brie Larson', 31, 'female'),
+                                  ('Bruce Willis', 65, 'male'),
+                                  ('Tom Hanks', 64, 'male')]:
+            self.client().post(
+                '/actors',
+                headers=self.headers,
+                data=json.dumps({'name': name, 'age': age, 'gender': gender})
+            )
+
+        response = self.client().get(
+            '/actors?gender=male&age_max=60&name=b&fields=name',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([actor['name'] for actor in data['actors']],
+                         ['Brad Pitt'])
+
+        response = self.client().get('/actors?name=b%25', headers=self.headers)
+        data = json.loads(response.data)
+
+        self.assertEqual(data['actors'], [])
+
+    def test_get_actors_invalid_filter(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {casting_assistant_token}'}
+        )
+        response = self.client().get('/actors?age_min=old',
+                                     headers=self.headers)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
     def test_add_new_actor(self):
         self.headers.update(
             {'Authorization': f'Bearer {casting_director_token}'}
@@ -120,6 +363,79 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 403)
         self.assertFalse(data['success'])
 
+    def test_add_new_actors_bulk(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {casting_director_token}'}
+        )
+        actors = [{'name': f'Actor {i}', 'age': 20 + i, 'gender': 'female'}
+                  for i in range(50)]
+
+        query_count = self.count_queries(lambda: self.client().post(
+            '/actors/bulk',
+            headers=self.headers,
+            data=json.dumps(actors[:25])
+        ))
+        response = self.client().post(
+            '/actors/bulk',
+            headers=self.headers,
+            data=json.dumps(actors[25:])
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['created'], 25)
+        self.assertEqual(len(data['ids']), 25)
+        # The multi-row INSERT and the version bump
+        self.assertEqual(query_count, 2)
+
+        response = self.client().get(
+            f'/actors?after_id={data["ids"][0] - 1}&limit=1',
+            headers=self.headers
+        )
+        self.assertEqual(json.loads(response.data)['actors'][0]['name'],
+                         'Actor 25')
+
+    def test_add_new_actors_bulk_invalid_items(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {casting_director_token}'}
+        )
+        response = self.client().post(
+            '/actors/bulk',
+            headers=self.headers,
+            data=json.dumps([
+                {'name': 'Jason Bourne', 'age': 35, 'gender': 'male'},
+                {'name': 'Jason Bourne', 'gender': 'male'},
+                {'name': 'Jason Bourne', 'age': '35', 'gender': 'male'},
+                'Jason Bourne'
+            ])
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+        self.assertEqual([error['index'] for error in data['errors']],
+                         [1, 2, 3])
+
+        response = self.client().get('/actors', headers=self.headers)
+        self.assertEqual(json.loads(response.data)['actors'], [])
+
+    def test_add_new_actors_bulk_no_permission(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {casting_assistant_token}'}
+        )
+        response = self.client().post(
+            '/actors/bulk',
+            headers=self.headers,
+            data=json.dumps([
+                {'name': 'Jason Bourne', 'age': 35, 'gender': 'male'}
+            ])
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(data['success'])
+
     def test_update_actor(self):
         self.headers.update(
             {'Authorization': f'Bearer {casting_director_token}'}
@@ -155,6 +471,53 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data['actor']['gender'], 'female')
         self.assertIsInstance(data['actor']['movies'], list)
 
+    def test_update_actor_single_statement(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        self.add_movie_with_cast(1)
+        response = self.client().get('/actors?fields=id',
+                                     headers=self.headers)
+        actor_id = json.loads(response.data)['actors'][0]['id']
+
+        responses = []
+        query_count = self.count_queries(lambda: responses.append(
+            self.client().patch(
+                f'/actors/{actor_id}',
+                headers=self.headers,
+                data=json.dumps({'age': 36})
+            )
+        ))
+        data = json.loads(responses[0].data)
+
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(data['actor'], {
+            'id': actor_id,
+            'name': 'Jason Bourne',
+            'age': 36,
+            'gender': 'male',
+            'movies': [{
+                'title': 'The Devil All the Time',
+                'release_year': '2020',
+                'genre': 'Drama'
+            }]
+        })
+        # The UPDATE ... RETURNING, the version bump and the movies
+        self.assertEqual(query_count, 3)
+
+    def test_update_actor_invalid_value(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {casting_director_token}'}
+        )
+        query_count = self.count_queries(lambda: self.assertEqual(
+            self.client().patch(
+                '/actors/1',
+                headers=self.headers,
+                data=json.dumps({'age': 'thirty'})
+            ).status_code, 400))
+
+        self.assertEqual(query_count, 0)
+
     def test_update_actor_no_actor_id(self):
         self.headers.update(
             {'Authorization': f'Bearer {casting_director_token}'}
@@ -342,6 +705,425 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 401)
         self.assertFalse(data['success'])
 
+    def test_get_movies_paginated(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        movie_ids = []
+        for title in ['The Godfather', 'Whiplash', 'The Dark Knight']:
+            response = self.client().post(
+                '/movies',
+                headers=self.headers,
+                data=json.dumps({
+                    'title': title,
+                    'release_year': '2020',
+                    'genre': 'Drama'
+                })
+            )
+            movie_ids.append(json.loads(response.data)['movie']['id'])
+
+        response = self.client().get(
+            f'/movies?limit=2&after_id={movie_ids[0]}',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual([m['id'] for m in data['movies']], movie_ids[1:])
+        self.assertIsNone(data['next'])
+
+    def test_get_movies_constant_query_count(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        self.add_movie_with_cast(2)
+        few_rows = self.count_queries(
+            lambda: self.client().get('/movies', headers=self.headers))
+
+        for _ in range(4):
+            self.add_movie_with_cast(3)
+        many_rows = self.count_queries(
+            lambda: self.client().get('/movies', headers=self.headers))
+        actors_query_count = self.count_queries(
+            lambda: self.client().get('/actors', headers=self.headers))
+
+        self.assertEqual(few_rows, many_rows)
+        self.assertEqual(actors_query_count, many_rows)
+
+    def test_get_movies_streamed(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        movie_ids = [self.add_movie_with_cast(2) for _ in range(3)]
+
+        response = self.client().get(
+            '/movies?stream=true&limit=1',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual([m['id'] for m in data['movies']], movie_ids)
+        self.assertEqual(len(data['movies'][0]['actors']), 2)
+        self.assertIsNone(data['next'])
+
+    def test_get_movies_streamed_sparse_fields(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        movie_ids = [self.add_movie_with_cast(2) for _ in range(2)]
+
+        response = self.client().get(
+            '/movies?stream=true&fields=title',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['movies'], [
+            {'id': movie_id, 'title': 'The Devil All the Time'}
+            for movie_id in movie_ids
+        ])
+
+        response = self.client().get(
+            '/movies?stream=true&fields=id&include=actors',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual([sorted(movie) for movie in data['movies']],
+                         [['actors', 'id'], ['actors', 'id']])
+        self.assertEqual(len(data['movies'][0]['actors']), 2)
+
+        response = self.client().get(
+            '/movies?stream=true&fields=salary',
+            headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_movies_sparse_fields(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        movie_id = self.add_movie_with_cast(2)
+
+        response = self.client().get(
+            '/movies?fields=title',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['movies'], [
+            {'id': movie_id, 'title': 'The Devil All the Time'}
+        ])
+
+    def test_get_movies_include_actors(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        self.add_movie_with_cast(2)
+        self.add_movie_with_cast(0)
+
+        response = self.client().get(
+            '/movies?fields=id,title&include=actors',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(data['movies'][0]), {'id', 'title', 'actors'})
+        self.assertEqual(data['movies'][0]['actors'], [
+            {'name': 'Jason Bourne', 'age': 35, 'gender': 'male'}
+        ] * 2)
+        self.assertEqual(data['movies'][1]['actors'], [])
+
+    def test_get_movies_unknown_field(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {casting_assistant_token}'}
+        )
+        response = self.client().get(
+            '/movies?fields=budget',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_get_movies_filtered(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        for title, release_year, genre in [('Heat', '1995', 'Thriller'),
+                                           ('Her', '2013', 'Drama'),
+                                           ('Hereditary', '2018', 'Horror'),
+                                           ('Seven', '1995', 'Thriller')]:
+            self.client().post(
+                '/movies',
+                headers=self.headers,
+                data=json.dumps({
+                    'title': title,
+                    'release_year': release_year,
+                    'genre': genre
+                })
+            )
+
+        query_count = self.count_queries(lambda: self.client().get(
+            '/movies?title=he&release_year_min=1990&release_year_max=2015',
+            headers=self.headers
+        ))
+        response = self.client().get(
+            '/movies?title=he&release_year_min=1990&release_year_max=2015',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([movie['title'] for movie in data['movies']],
+                         ['Heat', 'Her'])
+        # The version lookup, the filtered page and the actors of the page
+        self.assertEqual(query_count, 3)
+
+        response = self.client().get('/movies?genre=Thriller&stream=true',
+                                     headers=self.headers)
+        data = json.loads(response.data)
+
+        self.assertEqual([movie['title'] for movie in data['movies']],
+                         ['Heat', 'Seven'])
+
+    def test_get_movies_release_year_not_four_digits(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        for title, release_year in [('Beowulf', '995'), ('Heat', '1995')]:
+            self.client().post(
+                '/movies',
+                headers=self.headers,
+                data=json.dumps({
+                    'title': title,
+                    'release_year': release_year,
+                    'genre': 'Drama'
+                })
+            )
+
+        response = self.client().get('/movies?release_year_min=1990',
+                                     headers=self.headers)
+        data = json.loads(response.data)
+
+        # '995' sorts after '1990' as text, but is not in the range
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([movie['title'] for movie in data['movies']],
+                         ['Heat'])
+
+        response = self.client().get('/movies?release_year_max=10000',
+                                     headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_movies_columnar(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        movie_id = self.add_movie_with_cast(2)
+        etag = self.client().get('/movies', headers=self.headers)\
+            .headers['ETag']
+
+        self.headers.update(
+            {'Accept': 'application/vnd.casting-agency.columnar+json'}
+        )
+        response = self.client().get('/movies', headers=self.headers)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype,
+                         'application/vnd.casting-agency.columnar+json')
+        self.assertIn('Accept', response.headers['Vary'])
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(data['movies']['id'], [movie_id])
+        self.assertEqual(data['movies']['title'], ['The Devil All the Time'])
+        self.assertEqual(data['movies']['actors'], [{
+            'name': ['Jason Bourne', 'Jason Bourne'],
+            'age': [35, 35],
+            'gender': ['male', 'male']
+        }])
+        self.assertIsNone(data['next'])
+
+    def test_get_actors_columnar_sparse(self):
+        self.headers.update({
+            'Authorization': f'Bearer {executive_producer_token}',
+            'Accept': 'application/vnd.casting-agency.columnar+json'
+        })
+        self.add_movie_with_cast(1)
+
+        response = self.client().get('/actors?fields=name',
+                                     headers=self.headers)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(data['actors']), {'id', 'name'})
+        self.assertEqual(data['actors']['name'], ['Jason Bourne'])
+
+    def test_get_movies_columnar_stream(self):
+        self.headers.update({
+            'Authorization': f'Bearer {casting_assistant_token}',
+            'Accept': 'application/vnd.casting-agency.columnar+json'
+        })
+        response = self.client().get('/movies?stream=true',
+                                     headers=self.headers)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 406)
+        self.assertFalse(data['success'])
+
+    def test_get_movies_not_modified(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        self.add_movie_with_cast(1)
+
+        response = self.client().get('/movies', headers=self.headers)
+        etag = response.headers['ETag']
+        self.assertEqual(response.status_code, 200)
+
+        self.headers.update({'If-None-Match': etag})
+        query_count = self.count_queries(
+            lambda: self.client().get('/movies', headers=self.headers))
+        response = self.client().get('/movies', headers=self.headers)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(query_count, 1)
+
+        self.add_movie_with_cast(0)
+        response = self.client().get('/movies', headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_get_movies_cached(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        movie_id = self.add_movie_with_cast(2)
+
+        response = self.client().get('/movies?limit=5', headers=self.headers)
+        query_count = self.count_queries(
+            lambda: self.client().get('/movies?limit=5', headers=self.headers))
+        cached = self.client().get('/movies?limit=5', headers=self.headers)
+
+        self.assertEqual(query_count, 1)
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(cached.headers['ETag'], response.headers['ETag'])
+        self.assertGreaterEqual(response_cache.stats()['hits'], 2)
+
+        self.client().patch(
+            f'/movies/{movie_id}',
+            headers=self.headers,
+            data=json.dumps({'title': 'Tenet'})
+        )
+        response = self.client().get('/movies?limit=5', headers=self.headers)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['movies'][0]['title'], 'Tenet')
+        self.assertEqual(len(data['movies'][0]['actors']), 2)
+
+    def test_genre_and_decade_stats(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        for title, release_year, genre in [('Heat', '1995', 'Thriller'),
+                                           ('Seven', '1995', 'Thriller'),
+                                           ('Her', '2013', 'Drama')]:
+            self.client().post(
+                '/movies',
+                headers=self.headers,
+                data=json.dumps({
+                    'title': title,
+                    'release_year': release_year,
+                    'genre': genre
+                })
+            )
+
+        response = self.client().get('/stats/genres', headers=self.headers)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['genres'], [
+            {'genre': 'Thriller', 'movies': 2},
+            {'genre': 'Drama', 'movies': 1}
+        ])
+
+        response = self.client().get('/stats/decades', headers=self.headers)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['decades'], [
+            {'decade': 1990, 'movies': 2},
+            {'decade': 2010, 'movies': 1}
+        ])
+
+    def test_actors_per_movie_stats(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        first_movie_id = self.add_movie_with_cast(2)
+        second_movie_id = self.add_movie_with_cast(0)
+
+        query_count = self.count_queries(lambda: self.client().get(
+            '/stats/actors-per-movie', headers=self.headers))
+        response = self.client().get('/stats/actors-per-movie',
+                                     headers=self.headers)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(movie['id'], movie['actors'])
+                          for movie in data['movies']],
+                         [(first_movie_id, 2), (second_movie_id, 0)])
+        self.assertIsNone(data['next'])
+        # The version lookup and the GROUP BY query
+        self.assertEqual(query_count, 2)
+
+        self.client().delete(f'/movies/{second_movie_id}',
+                             headers=self.headers)
+        response = self.client().get('/stats/actors-per-movie',
+                                     headers=self.headers)
+        data = json.loads(response.data)
+
+        self.assertEqual(len(data['movies']), 1)
+
+    def test_cast_age_stats(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        self.add_movie_with_cast(2)
+
+        response = self.client().get('/stats/cast-age-by-genre',
+                                     headers=self.headers)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['genres'], [{
+            'genre': 'Drama',
+            'cast': 2,
+            'min_age': 35,
+            'median_age': 35.0,
+            'avg_age': 35.0,
+            'max_age': 35
+        }])
+
+    def test_stats_no_auth(self):
+        response = self.client().get('/stats/genres', headers=self.headers)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(data['success'])
+
     def test_add_new_movie(self):
         self.headers.update(
             {'Authorization': f'Bearer {executive_producer_token}'}
@@ -416,6 +1198,64 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 403)
         self.assertFalse(data['success'])
 
+    def test_add_new_movies_bulk(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        response = self.client().post(
+            '/movies/bulk',
+            headers=self.headers,
+            data=json.dumps([
+                {'title': 'Heat', 'release_year': 1995, 'genre': 'Thriller'},
+                {'title': 'Her', 'release_year': '2013', 'genre': 'Drama'}
+            ])
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['created'], 2)
+
+        response = self.client().get('/movies', headers=self.headers)
+        movies = json.loads(response.data)['movies']
+        self.assertEqual([movie['id'] for movie in movies], data['ids'])
+        self.assertEqual(movies[0]['release_year'], '1995')
+
+    def test_add_new_movies_bulk_empty(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        response = self.client().post(
+            '/movies/bulk',
+            headers=self.headers,
+            data=json.dumps([])
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_delete_movie_with_cast(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        movie_id = self.add_movie_with_cast(3)
+
+        query_count = self.count_queries(lambda: self.assertEqual(
+            self.client().delete(f'/movies/{movie_id}',
+                                 headers=self.headers).status_code, 200))
+        response = self.client().get('/actors?include=movies',
+                                     headers=self.headers)
+        data = json.loads(response.data)
+
+        # The DELETE ... RETURNING and the version bump, whatever the cast
+        self.assertEqual(query_count, 2)
+        self.assertEqual(len(data['actors']), 3)
+        self.assertTrue(all(actor['movies'] == [] for actor in data['actors']))
+
+        response = self.client().delete(f'/movies/{movie_id}',
+                                        headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
     def test_update_movie(self):
         self.headers.update(
             {'Authorization': f'Bearer {executive_producer_token}'}
@@ -699,6 +1539,102 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 409)
         self.assertFalse(data['success'])
 
+    def test_add_actors_to_movie(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        movie_id = self.add_movie_with_cast(1)
+        response = self.client().post(
+            '/actors/bulk',
+            headers=self.headers,
+            data=json.dumps([
+                {'name': f'Actor {i}', 'age': 30, 'gender': 'male'}
+                for i in range(3)
+            ])
+        )
+        new_ids = json.loads(response.data)['ids']
+        existing_id = new_ids[0] - 1
+
+        query_count = self.count_queries(lambda: self.client().post(
+            f'/movies/{movie_id}/actors',
+            headers=self.headers,
+            data=json.dumps({'actor_ids': [existing_id] + new_ids[:2]})
+        ))
+        response = self.client().post(
+            f'/movies/{movie_id}/actors',
+            headers=self.headers,
+            data=json.dumps({'actor_ids': new_ids})
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['added'], new_ids[2:])
+        self.assertEqual(data['skipped'], new_ids[:2])
+        self.assertEqual(len(data['movie']['actors']), 4)
+        # The roles INSERT, the version bump and the reload of the movie
+        # with its cast
+        self.assertEqual(query_count, 3)
+
+    def test_add_actors_to_movie_not_found(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        movie_id = self.add_movie_with_cast(1)
+        response = self.client().post(
+            f'/movies/{movie_id}/actors',
+            headers=self.headers,
+            data=json.dumps({'actor_ids': [123456, 654321]})
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(data['success'])
+        self.assertIn('123456, 654321', data['message'])
+
+    def test_add_actor_to_movie_not_found(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        movie_id = self.add_movie_with_cast(1)
+
+        response = self.client().post(
+            f'/movies/{movie_id + 1}/actors',
+            headers=self.headers,
+            data=json.dumps({'actor_id': 1})
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(data['message'], f'Movie_id {movie_id + 1} not found.')
+
+        response = self.client().post(
+            f'/movies/{movie_id}/actors',
+            headers=self.headers,
+            data=json.dumps({'actor_id': 123456})
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(data['message'], 'Actor_id 123456 not found.')
+
+    def test_add_actor_to_movie_rows_changed_meanwhile(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        movie_id = self.add_movie_with_cast(1)
+
+        with APP.test_request_context():
+            actor_id = Movie.query.get(movie_id).actors[0].id
+            # Both rows exist again by the time the failure is described
+            self.assertEqual(
+                describe_missing(movie_id, [actor_id]),
+                f'Movie_id {movie_id} or one of the actor IDs not found.')
+            # The movie was deleted right after the actors were added
+            with self.assertRaises(NotFound) as context:
+                get_formatted(Movie, Movie.actors, movie_id + 1)
+            self.assertEqual(context.exception.description,
+                             f'Movie_id {movie_id + 1} not found.')
+
     def test_add_actor_to_movie_no_auth(self):
         response = self.client().post(
             '/movies/1/actors',
@@ -777,6 +1713,39 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data['actor_id'], movie_data['movie']['id'])
         self.assertEqual(data['movie_id'], actor_data['actor']['id'])
 
+    def test_delete_actor_from_movie_single_statement(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        movie_id = self.add_movie_with_cast(1)
+        response = self.client().get('/actors?fields=id',
+                                     headers=self.headers)
+        actor_id = json.loads(response.data)['actors'][0]['id']
+
+        query_count = self.count_queries(lambda: self.client().delete(
+            f'/movies/{movie_id}/actors/{actor_id}',
+            headers=self.headers
+        ))
+        response = self.client().delete(
+            f'/movies/{movie_id}/actors/{actor_id}',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        # The DELETE ... RETURNING and the version bump
+        self.assertEqual(query_count, 2)
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('does not have a role', data['message'])
+
+        response = self.client().delete(
+            f'/movies/{movie_id}/actors/123456',
+            headers=self.headers
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(data['message'], 'Actor_id 123456 not found.')
+
     def test_delete_actor_from_movie_no_role(self):
         self.headers.update(
             {'Authorization': f'Bearer {executive_producer_token}'}
@@ -858,6 +1827,216 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertFalse(data['success'])
 
 
+    def test_batch(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        movie_id = self.add_movie_with_cast(1)
+        operations = [
+            {'op': 'create', 'resource': 'movies', 'ref': 'movie',
+             'data': {'title': 'Tenet', 'release_year': '2020',
+                      'genre': 'Thriller'}},
+            {'op': 'create', 'resource': 'actors', 'ref': 'actor',
+             'data': {'name': 'John David Washington', 'age': 36,
+                      'gender': 'male'}},
+            {'op': 'link', 'movie_id': '$movie', 'actor_ids': ['$actor']},
+            {'op': 'update', 'resource': 'movies', 'id': movie_id,
+             'data': {'genre': 'Crime'}},
+            {'op': 'delete', 'resource': 'actors', 'id': '$actor'}
+        ]
+
+        commits = []
+
+        def commit(conn):
+            commits.append(conn)
+
+        event.listen(db.engine, 'commit', commit)
+        try:
+            response = self.client().post(
+                '/batch',
+                headers=self.headers,
+                data=json.dumps({'operations': operations})
+            )
+        finally:
+            event.remove(db.engine, 'commit', commit)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        new_movie_id = data['results'][0]['id']
+        actor_id = data['results'][1]['id']
+        self.assertEqual(data['results'][2], {
+            'movie_id': new_movie_id,
+            'added': [actor_id],
+            'skipped': []
+        })
+        self.assertEqual(data['results'][3:],
+                         [{'id': movie_id}, {'id': actor_id}])
+        # A single transaction for all the operations
+        self.assertEqual(len(commits), 1)
+
+        response = self.client().get('/movies', headers=self.headers)
+        movies = {movie['id']: movie
+                  for movie in json.loads(response.data)['movies']}
+        self.assertEqual(movies[movie_id]['genre'], 'Crime')
+        self.assertEqual(movies[new_movie_id]['actors'], [])
+
+    def test_batch_bumps_versions_once(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.client().post(
+                '/batch',
+                headers=self.headers,
+                data=json.dumps([
+                    {'op': 'create', 'resource': 'movies', 'ref': 'movie',
+                     'data': {'title': 'Tenet', 'release_year': '2020',
+                              'genre': 'Thriller'}},
+                    {'op': 'create', 'resource': 'actors', 'ref': 'actor',
+                     'data': {'name': 'John David Washington', 'age': 36,
+                              'gender': 'male'}},
+                    {'op': 'link', 'movie_id': '$movie',
+                     'actor_ids': ['$actor']}
+                ])
+            )
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+
+        self.assertEqual(response.status_code, 200)
+        bumps = [statement for statement in statements
+                 if statement.startswith('INSERT INTO table_versions')]
+        # A single bump of all the written tables, after every write
+        self.assertEqual(len(bumps), 1)
+        self.assertEqual(statements[-1], bumps[0])
+        self.assertEqual(
+            TableVersion.get_versions('actors', 'movies', 'roles'),
+            (1, 1, 1))
+
+    def test_batch_rollback(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        response = self.client().post(
+            '/batch',
+            headers=self.headers,
+            data=json.dumps([
+                {'op': 'create', 'resource': 'actors', 'ref': 'actor',
+                 'data': {'name': 'Jason Bourne', 'age': 35,
+                          'gender': 'male'}},
+                {'op': 'link', 'movie_id': 1000, 'actor_ids': ['$actor']}
+            ])
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(data['success'])
+        self.assertEqual(data['index'], 1)
+
+        response = self.client().get('/actors', headers=self.headers)
+        self.assertEqual(json.loads(response.data)['actors'], [])
+
+    def test_batch_invalid_operation(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        response = self.client().post(
+            '/batch',
+            headers=self.headers,
+            data=json.dumps([
+                {'op': 'create', 'resource': 'actors',
+                 'data': {'name': 'Jason Bourne', 'age': 35,
+                          'gender': 'male'}},
+                {'op': 'delete', 'resource': 'actors', 'id': '$actor'}
+            ])
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['index'], 1)
+
+        response = self.client().get('/actors', headers=self.headers)
+        self.assertEqual(json.loads(response.data)['actors'], [])
+
+    def test_batch_ref_of_other_resource(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {executive_producer_token}'}
+        )
+        response = self.client().post(
+            '/batch',
+            headers=self.headers,
+            data=json.dumps([
+                {'op': 'create', 'resource': 'actors', 'ref': 'actor',
+                 'data': {'name': 'Jason Bourne', 'age': 35,
+                          'gender': 'male'}},
+                {'op': 'delete', 'resource': 'movies', 'id': '$actor'}
+            ])
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(data['success'])
+        self.assertEqual(data['index'], 1)
+
+        response = self.client().post(
+            '/batch',
+            headers=self.headers,
+            data=json.dumps([
+                {'op': 'create', 'resource': 'actors', 'ref': 'actor',
+                 'data': {'name': 'Jason Bourne', 'age': 35,
+                          'gender': 'male'}},
+                {'op': 'link', 'movie_id': '$actor', 'actor_ids': [1]}
+            ])
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['index'], 1)
+
+        response = self.client().get('/actors', headers=self.headers)
+        self.assertEqual(json.loads(response.data)['actors'], [])
+
+    def test_batch_no_permission(self):
+        self.headers.update(
+            {'Authorization': f'Bearer {casting_director_token}'}
+        )
+        response = self.client().post(
+            '/batch',
+            headers=self.headers,
+            data=json.dumps([
+                {'op': 'create', 'resource': 'actors',
+                 'data': {'name': 'Jason Bourne', 'age': 35,
+                          'gender': 'male'}},
+                {'op': 'delete', 'resource': 'movies', 'id': 1}
+            ])
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(data['success'])
+        self.assertEqual(data['index'], 1)
+
+        response = self.client().get('/actors', headers=self.headers)
+        self.assertEqual(json.loads(response.data)['actors'], [])
+
+    def test_batch_no_auth(self):
+        response = self.client().post(
+            '/batch',
+            headers=self.headers,
+            data=json.dumps([])
+        )
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(data['success'])
+
 # Make the tests conveniently executable
 if __name__ == '__main__':
     unittest.main(testRunner=HtmlTestRunner.HTMLTestRunner(
@@ -0,0 +1,391 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import HtmlTestRunner
+from flask import Flask
+
+from auth import auth
+from auth.auth import AuthError, check_permissions, requires_auth, \
+    verify_decode_jwt
+from auth.jwks import JWKSCache
+from auth.testing import make_signing_key, mint_token, write_jwks
+from auth.timing import AuthTiming
+from auth.token_cache import TokenCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingJWKSCache(JWKSCache):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fetches = 0
+        self.fetch_threads = []
+
+    def fetch(self):
+        self.fetches += 1
+        self.fetch_threads.append(threading.current_thread().name)
+        return super().fetch()
+
+
+class SlowJWKSCache(CountingJWKSCache):
+    def fetch(self):
+        time.sleep(0.1)
+        return super().fetch()
+
+
+class AuthTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key, cls.jwk = make_signing_key('test-key')
+        cls.rotated_key, cls.rotated_jwk = make_signing_key('rotated-key')
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.jwks_path = os.path.join(self.tmpdir.name, 'jwks.json')
+        self.write_jwks([self.jwk])
+        self.jwks_url = f'file://{self.jwks_path}'
+        self.clock = FakeClock()
+        self.cache = CountingJWKSCache(
+            self.jwks_url, ttl=60, min_refresh_interval=10, clock=self.clock
+        )
+        self.token_cache = TokenCache(maxsize=2)
+        self.timing = AuthTiming()
+        self.originals = (auth.jwks_cache, auth.token_cache, auth.auth_timing)
+        auth.jwks_cache, auth.token_cache, auth.auth_timing = \
+            self.cache, self.token_cache, self.timing
+
+    def tearDown(self):
+        auth.jwks_cache, auth.token_cache, auth.auth_timing = self.originals
+        self.tmpdir.cleanup()
+
+    def write_jwks(self, keys):
+        write_jwks(self.jwks_path, keys)
+
+    def wait_for_revalidation(self):
+        for _ in range(100):
+            if not self.cache._revalidating:
+                return
+            time.sleep(0.01)
+
+    def test_jwks_fetched_once(self):
+        key = self.cache.get_key('test-key')
+        for _ in range(5):
+            self.assertIs(self.cache.get_key('test-key'), key)
+        self.assertEqual(self.cache.fetches, 1)
+
+    def test_jwks_keys_parsed_by_kid(self):
+        self.write_jwks([
+            self.jwk,
+            dict(self.rotated_jwk, use='enc'),
+            {'kty': 'RSA', 'kid': 'broken', 'n': '', 'e': ''}
+        ])
+        self.assertEqual(list(self.cache.get_keys()), ['test-key'])
+
+    def test_stale_jwks_served_while_revalidating(self):
+        self.cache.get_jwks()
+        self.write_jwks([self.jwk, self.rotated_jwk])
+        self.clock.now += 61
+
+        keys = self.cache.get_keys()
+        self.wait_for_revalidation()
+
+        self.assertEqual(list(keys), ['test-key'])
+        self.assertEqual(self.cache.fetches, 2)
+        self.assertEqual(len(self.cache.get_keys()), 2)
+
+    def test_stale_jwks_kept_when_upstream_fails(self):
+        self.cache.get_jwks()
+        os.remove(self.jwks_path)
+        self.clock.now += 61
+
+        self.cache.get_jwks()
+        self.wait_for_revalidation()
+
+        self.assertIsNotNone(self.cache.get_key('test-key'))
+
+    def test_unknown_kid_forces_refresh(self):
+        self.cache.get_jwks()
+        self.write_jwks([self.jwk, self.rotated_jwk])
+        self.clock.now += 11
+
+        self.assertIsNotNone(self.cache.get_key('rotated-key'))
+        self.assertEqual(self.cache.fetches, 2)
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        self.cache.get_jwks()
+        self.clock.now += 11
+        self.assertIsNone(self.cache.get_key('missing-key'))
+        self.assertIsNone(self.cache.get_key('missing-key'))
+        self.assertEqual(self.cache.fetches, 2)
+
+    def test_concurrent_refreshes_coalesced(self):
+        cache = SlowJWKSCache(self.jwks_url)
+        threads = [threading.Thread(target=cache.refresh) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(cache.fetches, 1)
+        self.assertIn('test-key', cache.get_keys())
+
+    def test_jwks_shared_through_cache_file(self):
+        cache_file = os.path.join(self.tmpdir.name, 'shared-jwks.json')
+        first = CountingJWKSCache(self.jwks_url, cache_file=cache_file)
+        second = CountingJWKSCache(self.jwks_url, cache_file=cache_file)
+
+        self.assertIsNotNone(first.get_key('test-key'))
+        self.assertIsNotNone(second.get_key('test-key'))
+        self.assertEqual(first.fetches, 1)
+        self.assertEqual(second.fetches, 0)
+
+    def test_cache_file_directory_created_private(self):
+        cache_file = os.path.join(self.tmpdir.name, 'shared', 'jwks.json')
+        cache = CountingJWKSCache(self.jwks_url, cache_file=cache_file)
+        self.assertIsNotNone(cache.get_key('test-key'))
+
+        directory = os.path.dirname(cache_file)
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+        self.assertEqual(os.stat(cache_file).st_mode & 0o777, 0o600)
+
+    def test_cache_file_writable_by_others_ignored(self):
+        cache_file = os.path.join(self.tmpdir.name, 'shared-jwks.json')
+        write_jwks(cache_file, [self.rotated_jwk])
+        os.chmod(cache_file, 0o666)
+
+        cache = CountingJWKSCache(self.jwks_url, cache_file=cache_file)
+        self.assertIsNone(cache.get_key('rotated-key'))
+        self.assertIsNotNone(cache.get_key('test-key'))
+        self.assertEqual(os.stat(cache_file).st_mode & 0o777, 0o600)
+
+    def test_cache_directory_writable_by_others_ignored(self):
+        directory = os.path.join(self.tmpdir.name, 'shared')
+        os.mkdir(directory)
+        os.chmod(directory, 0o777)
+        cache_file = os.path.join(directory, 'jwks.json')
+        write_jwks(cache_file, [self.rotated_jwk])
+
+        cache = CountingJWKSCache(self.jwks_url, cache_file=cache_file)
+        self.assertIsNotNone(cache.get_key('test-key'))
+        self.assertIsNone(cache.get_key('rotated-key'))
+        self.assertFalse(os.path.exists(cache_file + '.lock'))
+
+    def test_symlinked_lock_file_not_followed(self):
+        cache_file = os.path.join(self.tmpdir.name, 'shared-jwks.json')
+        target = os.path.join(self.tmpdir.name, 'target')
+        os.symlink(target, cache_file + '.lock')
+
+        cache = CountingJWKSCache(self.jwks_url, cache_file=cache_file)
+        self.assertIsNotNone(cache.get_key('test-key'))
+        self.assertFalse(os.path.exists(target))
+
+    def test_stale_cache_file_refetched(self):
+        cache_file = os.path.join(self.tmpdir.name, 'shared-jwks.json')
+        with open(cache_file, 'w') as f:
+            json.dump({'keys': []}, f)
+        os.utime(cache_file, (time.time() - 120, time.time() - 120))
+
+        cache = CountingJWKSCache(self.jwks_url, ttl=60, cache_file=cache_file)
+        self.assertIsNotNone(cache.get_key('test-key'))
+        self.assertEqual(cache.fetches, 1)
+
+    def test_prefetch_and_readiness(self):
+        self.assertFalse(self.cache.ready)
+        self.assertTrue(self.cache.prefetch())
+        self.assertTrue(self.cache.ready)
+
+    def test_prefetch_failure_is_not_fatal(self):
+        os.remove(self.jwks_path)
+        self.assertFalse(self.cache.prefetch())
+
+    def test_setup_auth_keeps_fetches_off_request_threads(self):
+        cache = SlowJWKSCache(self.jwks_url, ttl=60)
+        auth.jwks_cache = cache
+        app = Flask(__name__)
+        app.config['JWKS_PREFETCH'] = True
+
+        @app.route('/')
+        @requires_auth('get:actors')
+        def index(payload):
+            return 'ok'
+
+        token = mint_token(self.private_key, 'test-key', ['get:actors'])
+        headers = {'Authorization': f'Bearer {token}'}
+        auth.setup_auth(app)
+        try:
+            # The first request does not wait for the keys
+            response = app.test_client().get('/', headers=headers)
+            self.assertEqual(response.status_code, 401)
+
+            for _ in range(100):
+                if cache.ready:
+                    break
+                time.sleep(0.01)
+            response = app.test_client().get('/', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(cache.fetch_threads, ['jwks-refresher'])
+        finally:
+            cache.stop_refresher()
+
+    def test_setup_auth_skipped_when_testing(self):
+        app = Flask(__name__)
+        app.config.update(JWKS_PREFETCH=True, TESTING=True)
+        self.assertIsNone(auth.setup_auth(app))
+
+        app.test_client().get('/')
+        self.assertFalse(self.cache.ready)
+        self.assertIsNone(self.cache._refresher)
+
+    def test_refresher_loads_keys_in_background(self):
+        os.remove(self.jwks_path)
+        cache = CountingJWKSCache(self.jwks_url, min_refresh_interval=0)
+        cache.start_refresher(interval=60, retry_interval=0.01)
+        try:
+            self.assertEqual(cache.get_keys(), {})
+            self.write_jwks([self.jwk])
+            for _ in range(100):
+                if cache.ready:
+                    break
+                time.sleep(0.01)
+            self.assertIsNotNone(cache.get_key('test-key'))
+        finally:
+            cache.stop_refresher()
+
+    def test_refresher_keeps_unknown_kid_off_request_thread(self):
+        self.cache.prefetch()
+        self.cache.start_refresher(interval=60)
+        try:
+            self.write_jwks([self.jwk, self.rotated_jwk])
+            self.clock.now += 11
+
+            self.assertIsNone(self.cache.get_key('rotated-key'))
+            self.wait_for_revalidation()
+            self.assertIsNotNone(self.cache.get_key('rotated-key'))
+        finally:
+            self.cache.stop_refresher()
+
+    def test_verify_decode_jwt(self):
+        token = mint_token(self.private_key, 'test-key', ['get:actors'])
+        payload = verify_decode_jwt(token)
+        self.assertEqual(payload['permissions'], ['get:actors'])
+
+    def test_verify_decode_jwt_unknown_kid(self):
+        token = mint_token(self.rotated_key, 'rotated-key', ['get:actors'])
+        with self.assertRaises(AuthError) as cm:
+            verify_decode_jwt(token)
+        self.assertEqual(cm.exception.status_code, 401)
+
+    def test_verify_decode_jwt_cached(self):
+        token = mint_token(self.private_key, 'test-key', ['get:actors'])
+        first = verify_decode_jwt(token)
+        second = verify_decode_jwt(token)
+
+        self.assertIs(first, second)
+        self.assertEqual(self.token_cache.stats()['hits'], 1)
+        self.assertEqual(self.token_cache.stats()['misses'], 1)
+
+    def test_verify_decode_jwt_compiles_permissions(self):
+        token = mint_token(self.private_key, 'test-key',
+                           ['get:actors', 'get:movies'])
+        payload = verify_decode_jwt(token)
+
+        self.assertEqual(payload.permission_set,
+                         frozenset(['get:actors', 'get:movies']))
+        self.assertIs(verify_decode_jwt(token).permission_set,
+                      payload.permission_set)
+
+    def test_check_permissions(self):
+        payload = {'permissions': ['get:actors']}
+        self.assertTrue(check_permissions('get:actors', payload))
+
+        with self.assertRaises(AuthError) as cm:
+            check_permissions('post:actors', payload)
+        self.assertEqual(cm.exception.status_code, 403)
+
+        with self.assertRaises(AuthError) as cm:
+            check_permissions('get:actors', {})
+        self.assertEqual(cm.exception.status_code, 400)
+
+    def auth_client(self):
+        app = Flask(__name__)
+
+        @app.route('/actors')
+        @requires_auth('get:actors')
+        def get_actors(payload):
+            return 'ok'
+
+        return app.test_client()
+
+    def test_auth_timing_disabled(self):
+        token = mint_token(self.private_key, 'test-key', ['get:actors'])
+        response = self.auth_client().get(
+            '/actors', headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response.headers)
+        self.assertEqual(self.timing.snapshot(), {})
+
+    def test_auth_timing_enabled(self):
+        self.timing.enabled = True
+        token = mint_token(self.private_key, 'test-key', ['get:actors'])
+        client = self.auth_client()
+        headers = {'Authorization': f'Bearer {token}'}
+        client.get('/actors', headers=headers)
+        response = client.get('/actors', headers=headers)
+
+        phases = [entry.split(';')[0] for entry in
+                  response.headers['Server-Timing'].split(', ')]
+        self.assertEqual(phases, ['auth-header', 'auth-token_cache',
+                                  'auth-permissions'])
+
+        snapshot = self.timing.snapshot()
+        self.assertEqual(snapshot['header']['count'], 2)
+        self.assertEqual(snapshot['jwks']['count'], 1)
+        self.assertEqual(snapshot['verify']['count'], 1)
+        self.assertEqual(
+            sum(snapshot['permissions']['buckets'].values()), 2)
+
+    def test_auth_timing_on_rejected_request(self):
+        self.timing.enabled = True
+        token = mint_token(self.private_key, 'test-key', ['get:movies'])
+        response = self.auth_client().get(
+            '/actors', headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('auth-permissions', response.headers['Server-Timing'])
+
+    def test_token_cache_expiry(self):
+        clock = FakeClock()
+        cache = TokenCache(maxsize=2, clock=clock)
+        cache.put('token', {'exp': clock.now + 5})
+        self.assertIsNotNone(cache.get('token'))
+
+        clock.now += 5
+        self.assertIsNone(cache.get('token'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_token_cache_lru_eviction(self):
+        cache = TokenCache(maxsize=2, clock=FakeClock())
+        cache.put('a', {'exp': 2000})
+        cache.put('b', {'exp': 2000})
+        cache.get('a')
+        cache.put('c', {'exp': 2000})
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+
+# Make the tests conveniently executable
+if __name__ == '__main__':
+    unittest.main(testRunner=HtmlTestRunner.HTMLTestRunner(
+        output="./test_results/"))
@@ -0,0 +1,72 @@
+import unittest
+import HtmlTestRunner
+
+from cache import ResponseCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResponseCache(maxsize=2, max_bytes=10, ttl=60,
+                                   clock=self.clock)
+
+    def test_hit(self):
+        self.cache.put('a', (1, 1), b'body', 'application/json')
+
+        self.assertEqual(self.cache.get('a', (1, 1)),
+                         (b'body', 'application/json'))
+        self.assertIsNone(self.cache.get('b', (1, 1)))
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_invalidated_by_new_versions(self):
+        self.cache.put('a', (1, 1), b'body', 'application/json')
+
+        self.assertIsNone(self.cache.get('a', (1, 2)))
+        self.assertIsNone(self.cache.get('a', (1, 1)))
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_expiry(self):
+        self.cache.put('a', (1,), b'body', 'application/json')
+        self.clock.now += 60
+
+        self.assertIsNone(self.cache.get('a', (1,)))
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    def test_lru_eviction(self):
+        self.cache.put('a', (1,), b'a', 'application/json')
+        self.cache.put('b', (1,), b'b', 'application/json')
+        self.cache.get('a', (1,))
+        self.cache.put('c', (1,), b'c', 'application/json')
+
+        self.assertIsNotNone(self.cache.get('a', (1,)))
+        self.assertIsNone(self.cache.get('b', (1,)))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_byte_bound(self):
+        self.cache.put('a', (1,), b'123456', 'application/json')
+        self.cache.put('b', (1,), b'123456', 'application/json')
+        self.cache.put('c', (1,), b'12345678901', 'application/json')
+
+        stats = self.cache.stats()
+        self.assertIsNone(self.cache.get('a', (1,)))
+        self.assertIsNone(self.cache.get('c', (1,)))
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['size_bytes'], 6)
+
+
+# Make the tests conveniently executable
+if __name__ == '__main__':
+    unittest.main(testRunner=HtmlTestRunner.HTMLTestRunner(
+        output="./test_results/"))
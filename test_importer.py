@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+import unittest
+import HtmlTestRunner
+
+import config
+from app import APP
+from models import db, Actor, Movie, Role, TableVersion
+
+
+class ImporterTestCase(unittest.TestCase):
+    def setUp(self):
+        APP.config['SQLALCHEMY_DATABASE_URI'] = config.TEST_DATABASE_URL
+        self.runner = APP.test_cli_runner(mix_stderr=False)
+        self.directory = tempfile.mkdtemp()
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        shutil.rmtree(self.directory)
+
+    def write_file(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def import_file(self, *args):
+        result = self.runner.invoke(args=['import'] + list(args))
+        db.session.remove()
+        return result
+
+    def test_import_csv(self):
+        path = self.write_file('actors.csv', (
+            'id,name,age,gender\n'
+            '1,"Bourne, Jason",35,male\n'
+            '2,Viola Davis,55,female\n'
+            '1,Jason Bourne,36,\n'
+        ))
+        result = self.import_file('actors', path)
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('3 rows read, 2 inserted, 0 updated, 1 skipped',
+                      result.stderr)
+        # The last row with the same id wins, and empty values are NULL
+        actor = Actor.query.get(1)
+        self.assertEqual((actor.name, actor.age, actor.gender),
+                         ('Jason Bourne', 36, None))
+        self.assertEqual(TableVersion.get_versions('actors'), (1,))
+
+        # New actors do not reuse the imported IDs
+        actor = Actor(name='Emma Stone', age=32, gender='female')
+        actor.insert()
+        self.assertEqual(actor.id, 3)
+
+    def test_import_csv_on_conflict(self):
+        path = self.write_file('actors.csv', (
+            'id,name,age,gender\n'
+            '1,Jason Bourne,35,male\n'
+        ))
+        self.import_file('actors', path)
+        path = self.write_file('actors.csv', (
+            'id,name,age,gender\n'
+            '1,Jason Bourne,40,male\n'
+            '2,Viola Davis,55,female\n'
+        ))
+
+        result = self.import_file('actors', path, '--on-conflict', 'skip')
+        self.assertIn('1 inserted, 0 updated, 1 skipped', result.stderr)
+        self.assertEqual(Actor.query.get(1).age, 35)
+
+        result = self.import_file('actors', path)
+        self.assertIn('0 inserted, 2 updated, 0 skipped', result.stderr)
+        self.assertEqual(Actor.query.get(1).age, 40)
+
+    def test_import_ndjson_in_batches(self):
+        path = self.write_file('movies.ndjson', ''.join(
+            f'{{"title": "Movie {i}", "release_year": 2000, '
+            f'"genre": "Drama"}}\n'
+            for i in range(5)
+        ))
+        result = self.import_file('movies', path, '--batch-size', '2')
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(len(result.stderr.splitlines()), 3)
+        self.assertIn('Imported 5 of 5 rows into movies.', result.output)
+        self.assertEqual([movie.title for movie in
+                          Movie.query.order_by(Movie.id)],
+                         [f'Movie {i}' for i in range(5)])
+
+    def test_import_roles(self):
+        movie = Movie(title='The Help', release_year='2011', genre='Drama')
+        movie.insert()
+        actor = Actor(name='Viola Davis', age=55, gender='female')
+        actor.insert()
+        path = self.write_file('roles.csv', (
+            'movie_id,actor_id\n'
+            f'{movie.id},{actor.id}\n'
+            f'{movie.id},{actor.id}\n'
+            f'{movie.id},1000\n'
+        ))
+        result = self.import_file('roles', path)
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('1 inserted, 0 updated, 2 skipped', result.stderr)
+        self.assertEqual(Role.query.count(), 1)
+
+    def test_import_roles_reversed_columns(self):
+        # Two actors and two movies, so that swapped IDs would exist too
+        Movie(title='The Help', release_year='2011', genre='Drama').insert()
+        movie = Movie(title='Fences', release_year='2016', genre='Drama')
+        movie.insert()
+        actor = Actor(name='Viola Davis', age=55, gender='female')
+        actor.insert()
+        Actor(name='Denzel Washington', age=65, gender='male').insert()
+        movie_id, actor_id = movie.id, actor.id
+        path = self.write_file('roles.csv', (
+            'actor_id,movie_id\n'
+            f'{actor_id},{movie_id}\n'
+        ))
+        result = self.import_file('roles', path)
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('1 inserted, 0 updated, 0 skipped', result.stderr)
+        role = Role.query.one()
+        self.assertEqual((role.movie_id, role.actor_id), (movie_id, actor_id))
+
+    def test_import_unknown_column(self):
+        path = self.write_file('actors.csv', 'name,salary\nJason,1\n')
+        result = self.import_file('actors', path)
+
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('columns must be distinct columns', result.stderr)
+        self.assertEqual(Actor.query.count(), 0)
+
+    def test_import_invalid_line(self):
+        path = self.write_file('actors.jsonl', (
+            '{"name": "Jason Bourne"}\n'
+            '{"name": "Viola Davis"}\n'
+            '{"title": "The Help"}\n'
+        ))
+        result = self.import_file('actors', path, '--batch-size', '2')
+
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('line 3', result.stderr)
+        # The batches before the error are kept
+        self.assertEqual(Actor.query.count(), 2)
+
+
+# Make the tests conveniently executable
+if __name__ == '__main__':
+    unittest.main(testRunner=HtmlTestRunner.HTMLTestRunner(
+        output="./test_results/"))
@@ -0,0 +1,73 @@
+import json
+import unittest
+from uuid import UUID
+import HtmlTestRunner
+import flask
+from flask import Flask
+
+import serializer
+from serializer import get_encoder, setup_serializer, jsonify, dumps
+
+
+DATA = {
+    'success': True,
+    'movies': [{
+        'id': 1,
+        'title': 'Amélie',
+        'release_year': '2001',
+        'genre': 'Comedy',
+        'actors': [{'name': 'Audrey Tautou', 'age': 44, 'gender': 'female'}]
+    }],
+    'next': None
+}
+
+
+class SerializerTestCase(unittest.TestCase):
+    def make_app(self, name):
+        app = Flask(__name__)
+        setup_serializer(app, name)
+        return app
+
+    def test_json_encoder_is_flask_jsonify(self):
+        app = self.make_app('json')
+        with app.app_context():
+            self.assertEqual(jsonify(DATA).data, flask.jsonify(DATA).data)
+            self.assertEqual(json.loads(dumps(DATA)), DATA)
+
+    def test_unknown_encoder(self):
+        with self.assertRaises(ValueError):
+            get_encoder('yaml')
+
+    def test_auto_encoder(self):
+        name, _ = get_encoder('auto')
+        self.assertEqual(name,
+                         'json' if serializer.orjson is None else 'orjson')
+
+    @unittest.skipIf(serializer.orjson is None, 'orjson is not installed')
+    def test_orjson_encoder(self):
+        app = self.make_app('orjson')
+        with app.app_context():
+            response = jsonify(DATA)
+            self.assertEqual(response.mimetype, 'application/json')
+            self.assertEqual(json.loads(response.data), DATA)
+            self.assertEqual(json.loads(dumps(DATA)), DATA)
+
+            stdlib = self.make_app('json')
+            with stdlib.app_context():
+                expected = jsonify(DATA).data
+            self.assertEqual(list(json.loads(response.data)),
+                             list(json.loads(expected)))
+
+    @unittest.skipIf(serializer.orjson is None, 'orjson is not installed')
+    def test_orjson_encoder_fallback(self):
+        app = self.make_app('orjson')
+        with app.app_context():
+            response = jsonify(id=UUID(int=1))
+            self.assertEqual(json.loads(response.data),
+                             {'id': '00000000-0000-0000-0000-000000000001'})
+
+
+# Make the tests conveniently executable
+if __name__ == '__main__':
+    unittest.main(testRunner=HtmlTestRunner.HTMLTestRunner(
+        output="./test_results/"))